@@ -0,0 +1,117 @@
+import asyncio
+import hashlib
+import json
+import time
+import logging
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Prompt sent to Gemini after detection, filled in with the condition for the detected class
+ADVICE_PROMPT_TEMPLATE = "Hay giup toi dua ra loi khuyen cho can benh {condition}"
+
+# Detected class -> condition named in the advice prompt
+CLASS_CONDITIONS = {
+    "class_7": "shingles",
+    "class_2": "dd",
+    "class_3": "dd",
+}
+DEFAULT_CONDITION = "dd"
+
+
+def condition_for(class_name: str) -> str:
+    return CLASS_CONDITIONS.get(class_name, DEFAULT_CONDITION)
+
+
+def advice_prompt(class_name: str, template: str = ADVICE_PROMPT_TEMPLATE) -> str:
+    """Build the advice prompt for a detected class."""
+    return template.format(condition=condition_for(class_name))
+
+
+def config_fingerprint(*parts: Any) -> str:
+    """Short stable hash of the model settings that shape an answer."""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:12]
+
+
+class AdviceCache:
+    """
+    Caches Gemini advice per (condition, prompt template, model config).
+
+    There are only a handful of conditions, so after the first request for each
+    (or after precompute()) /detect no longer waits on Gemini at all.
+    """
+
+    def __init__(
+        self,
+        generate: Callable[[str], Awaitable[str]],
+        config_key: str,
+        template: str = ADVICE_PROMPT_TEMPLATE,
+        ttl_seconds: float = 86400.0
+    ):
+        self.generate = generate
+        self.config_key = config_key
+        self.template = template
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[Tuple[str, str, str], Tuple[float, str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.last_refresh: Optional[float] = None
+
+    def _key(self, condition: str) -> Tuple[str, str, str]:
+        return condition, self.template, self.config_key
+
+    async def _generate(self, condition: str) -> str:
+        answer = await self.generate(self.template.format(condition=condition))
+        self._entries[self._key(condition)] = (time.monotonic() + self.ttl_seconds, answer)
+        return answer
+
+    def prompt(self, class_name: str) -> str:
+        return advice_prompt(class_name, self.template)
+
+    def lookup(self, class_name: str) -> Optional[str]:
+        """Return cached advice for a detected class, or None on a miss."""
+        entry = self._entries.get(self._key(condition_for(class_name)))
+        if entry is not None and entry[0] > time.monotonic():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def store(self, class_name: str, answer: str):
+        """Cache advice that was generated outside get(), e.g. streamed to a client."""
+        self._entries[self._key(condition_for(class_name))] = (time.monotonic() + self.ttl_seconds, answer)
+
+    async def get(self, class_name: str) -> str:
+        """Return advice for a detected class, asking Gemini only on a miss."""
+        answer = self.lookup(class_name)
+        if answer is not None:
+            return answer
+        return await self._generate(condition_for(class_name))
+
+    async def precompute(self):
+        """Fetch fresh advice for every known condition."""
+        conditions = set(CLASS_CONDITIONS.values()) | {DEFAULT_CONDITION}
+        results = await asyncio.gather(*(self._generate(c) for c in sorted(conditions)), return_exceptions=True)
+        for condition, result in zip(sorted(conditions), results):
+            if isinstance(result, Exception):
+                logger.warning(f"Could not precompute advice for {condition}: {result}")
+        self.last_refresh = time.time()
+
+    async def refresh_forever(self, interval_seconds: float):
+        """Re-run precompute() every interval_seconds until cancelled."""
+        while True:
+            await self.precompute()
+            await asyncio.sleep(interval_seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "ttl_seconds": self.ttl_seconds,
+            "config_key": self.config_key,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "last_refresh": self.last_refresh,
+        }
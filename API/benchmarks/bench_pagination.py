@@ -0,0 +1,105 @@
+"""
+Latency of a GET /chat-history page at increasing depth, offset vs. keyset cursor.
+
+Seeds one user with --rows chat history rows (plus other users' rows around them) in a
+temporary SQLite database, then times the page query at each depth: with offset(depth),
+and with the cursor of the row just before that depth. Offset pages get slower with
+depth; cursor pages should stay flat.
+
+Usage:
+    python benchmarks/bench_pagination.py [--rows 200000 --limit 10 --repeat 20]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import insert, select
+from sqlalchemy.orm import sessionmaker
+
+import models
+import pagination
+from database import create_db_engine
+from migrations import run_migrations
+
+
+def seed(engine, rows: int, other_users: int):
+    models.Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        db.execute(insert(models.User), [
+            {"email": f"bench{i}@example.com", "username": f"bench{i}", "hashed_password": "x"}
+            for i in range(other_users + 1)
+        ])
+        start = datetime(2024, 1, 1)
+        batch = []
+        for i in range(rows * (other_users + 1)):
+            batch.append({
+                "user_id": 1 + i % (other_users + 1),
+                "message": f"question {i}",
+                "response": "answer " * 40,
+                # A few rows share a timestamp, so the id tie-break matters
+                "created_at": start + timedelta(seconds=i // 3),
+            })
+            if len(batch) == 10000:
+                db.execute(insert(models.ChatHistory), batch)
+                batch = []
+        if batch:
+            db.execute(insert(models.ChatHistory), batch)
+        db.commit()
+
+
+def timed(run, repeat: int) -> float:
+    """Median milliseconds of run() over `repeat` calls."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000, help="Chat history rows of the paged user")
+    parser.add_argument("--other-users", type=int, default=1, help="Users whose rows are interleaved with the paged user's")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    depths = [d for d in (0, 100, 1000, 10000, 100000, 1000000) if d < args.rows]
+    with tempfile.TemporaryDirectory(prefix="bench-pagination-") as workdir:
+        engine = create_db_engine(f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        seed(engine, args.rows, args.other_users)
+        Session = sessionmaker(bind=engine)
+        own = select(models.ChatHistory).where(models.ChatHistory.user_id == 1)
+
+        print(f"{args.rows} rows for the paged user, page size {args.limit}, median of {args.repeat}")
+        print(f"{'depth':>10s} {'offset ms':>10s} {'cursor ms':>10s}")
+        with Session() as db:
+            for depth in depths:
+                def by_offset():
+                    db.execute(pagination.newest_first(own, models.ChatHistory.created_at, models.ChatHistory.id, None, args.limit).offset(depth)).scalars().all()
+
+                cursor = None
+                if depth:
+                    before = db.execute(
+                        pagination.newest_first(own, models.ChatHistory.created_at, models.ChatHistory.id, None, 0).offset(depth - 1)
+                    ).scalars().first()
+                    cursor = pagination.encode_cursor(before.created_at, before.id)
+
+                def by_cursor():
+                    db.execute(pagination.newest_first(own, models.ChatHistory.created_at, models.ChatHistory.id, cursor, args.limit)).scalars().all()
+
+                print(f"{depth:10d} {timed(by_offset, args.repeat):10.2f} {timed(by_cursor, args.repeat):10.2f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
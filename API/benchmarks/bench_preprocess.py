@@ -0,0 +1,75 @@
+"""
+Compare the original preprocessing path with preprocess_into on a phone-sized JPEG.
+
+Usage:
+    python benchmarks/bench_preprocess.py [--width 4032 --height 3024 --iterations 20]
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from detection_utils import preprocess_into
+
+
+def make_jpeg(width: int, height: int) -> bytes:
+    """Build a noisy gradient JPEG so the encoder can't cheat on flat colour."""
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    pixels = np.stack([x + 0 * y, y + 0 * x, (x + y) / 2], axis=-1)
+    pixels += rng.normal(0, 20, pixels.shape)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), "RGB")
+    buf = io.BytesIO()
+    image.save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def legacy_preprocess(image_data: bytes, image_size) -> np.ndarray:
+    """The preprocessing path used before preprocess_into."""
+    image = Image.open(io.BytesIO(image_data))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    image = image.resize(image_size)
+    img_array = np.asarray(image, dtype=np.float32)
+    img_array = np.expand_dims(img_array, axis=0)
+    return img_array / 255.0
+
+
+def bench(fn, iterations: int) -> float:
+    fn()  # warm up
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--size", type=int, default=224, help="Model input size")
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    image_data = make_jpeg(args.width, args.height)
+    image_size = (args.size, args.size)
+    out = np.empty((args.size, args.size, 3), dtype=np.float32)
+
+    legacy = bench(lambda: legacy_preprocess(image_data, image_size), args.iterations)
+    current = bench(lambda: preprocess_into(image_data, image_size, out), args.iterations)
+
+    print(f"Image: {args.width}x{args.height} JPEG, {len(image_data) / 1024:.0f} KiB -> {args.size}x{args.size}")
+    print(f"legacy preprocess:  {legacy * 1000:8.2f} ms/image")
+    print(f"preprocess_into:    {current * 1000:8.2f} ms/image")
+    print(f"speedup:            {legacy / current:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
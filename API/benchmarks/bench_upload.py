@@ -0,0 +1,86 @@
+"""
+Compare peak Python memory of the old /detect upload handling with the single-pass path.
+
+The upload is held in a SpooledTemporaryFile, as Starlette does (1 MB in memory, then
+spilled to disk). The legacy path reads it twice into bytes; the current path hashes it
+in chunks and hands the file itself to the decoder.
+
+Usage:
+    python benchmarks/bench_upload.py [--width 4032 --height 3024]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi import UploadFile
+
+from detection_utils import ResultCache, preprocess_into
+from bench_preprocess import make_jpeg
+
+
+def spooled_upload(image_data: bytes) -> UploadFile:
+    spooled = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    spooled.write(image_data)
+    spooled.seek(0)
+    return UploadFile(spooled, size=len(image_data), filename="photo.jpg")
+
+
+async def legacy(file: UploadFile, out: np.ndarray):
+    """Size check and decode as /detect did before: two full reads into memory."""
+    if len(await file.read()) > file.size:
+        raise ValueError("too large")
+    await file.seek(0)
+    image_data = await file.read()
+    ResultCache.hash_image(image_data)
+    preprocess_into(image_data, out.shape[:2], out)
+
+
+async def single_pass(file: UploadFile, out: np.ndarray):
+    """Chunked read with the limit enforced as it goes, then decode from the file."""
+    from main import read_upload
+    await read_upload(file, file.size)
+    preprocess_into(file.file, out.shape[:2], out)
+
+
+def measure(handler, image_data: bytes, out: np.ndarray):
+    file = spooled_upload(image_data)
+    tracemalloc.start()
+    start = time.perf_counter()
+    asyncio.run(handler(file, out))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    file.file.close()
+    return peak, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--width", type=int, default=4032)
+    parser.add_argument("--height", type=int, default=3024)
+    parser.add_argument("--size", type=int, default=224, help="Model input size")
+    args = parser.parse_args()
+
+    image_data = make_jpeg(args.width, args.height)
+    out = np.empty((args.size, args.size, 3), dtype=np.float32)
+
+    # Import main (and its dependencies) outside the measured region
+    import main as _  # noqa: F401
+    measure(single_pass, image_data, out)
+
+    print(f"Upload: {args.width}x{args.height} JPEG, {len(image_data) / 1024 / 1024:.1f} MiB")
+    for name, handler in (("legacy (read twice)", legacy), ("single pass", single_pass)):
+        peak, elapsed = measure(handler, image_data, out)
+        print(f"{name:20s} peak {peak / 1024 / 1024:7.2f} MiB   {elapsed * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
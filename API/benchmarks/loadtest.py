@@ -0,0 +1,287 @@
+"""
+Load-test the API in-process with a fake detector and the local LLM provider.
+
+Boots main.app (lifespan included) against a throwaway SQLite database in a temp
+directory, swaps in a deterministic detector and runs the LLM gateway on its local
+provider (LLM_PROVIDER=local), both with configurable latency, then
+drives a weighted mix of /token, /detect, /chat, /chat-history and /admin/users from
+concurrent clients over httpx's ASGI transport. Prints throughput and p50/p95/p99
+latency per endpoint as JSON, so runs can be diffed over time.
+
+No model file, GEMINI_API_KEY or network access is needed. Client and server share one
+process and event loop, so compare runs made on the same machine with the same settings.
+
+Usage:
+    python benchmarks/loadtest.py [--duration 20 --concurrency 32 --mix detect=5,chat=2,history=2,token=1,admin=1]
+    python benchmarks/loadtest.py --detector-latency-ms 40 --llm-latency-ms 800 --output run.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import numpy as np
+from PIL import Image
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, API_DIR)
+
+ENDPOINTS = {
+    "token": "POST /token",
+    "detect": "POST /detect",
+    "chat": "POST /chat",
+    "history": "GET /chat-history",
+    "admin": "GET /admin/users",
+}
+
+PROMPTS = [
+    "What are the early signs of shingles?",
+    "How should I care for dry, itchy skin?",
+    "Is a red rash on the arm something to worry about?",
+    "Which creams help with eczema?",
+]
+
+
+class FakeDetector:
+    """
+    Stands in for ImageDetector: real preprocessing into a reused buffer, then a forward
+    pass that sleeps for a fixed latency plus a per-image cost and returns a one-hot
+    prediction derived from the image, so the same upload always gets the same class.
+    """
+
+    def __init__(self, latency_ms: float, per_image_ms: float, max_batch_size: int, num_classes: int = 10):
+        from detection_utils import supported_batch_sizes
+
+        self.latency = latency_ms / 1000.0
+        self.per_image = per_image_ms / 1000.0
+        self.num_classes = num_classes
+        self.image_size = (224, 224)
+        self.batch_sizes = supported_batch_sizes(max_batch_size)
+        self.model_version = "fake-000000000000"
+        self.warmup_seconds = 0.0
+        self._buffer = np.empty((self.batch_sizes[-1],) + self.image_size + (3,), dtype=np.float32)
+        self._lock = threading.Lock()
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        time.sleep(self.latency + self.per_image * batch.shape[0])
+        classes = (batch.reshape(batch.shape[0], -1)[:, ::997].sum(axis=1) * 1000).astype(np.int64) % self.num_classes
+        return np.eye(self.num_classes, dtype=np.float32)[classes]
+
+    def predict_batch(self, images):
+        from detection_utils import run_batch
+
+        with self._lock:
+            return run_batch(images, self.image_size, self.batch_sizes, self._buffer, self._forward)
+
+    def describe(self):
+        return {"model_version": self.model_version, "backend": "fake", "batch_sizes": list(self.batch_sizes), "warmup_seconds": 0.0}
+
+    def close(self):
+        pass
+
+
+def make_images(count: int, seed: int) -> List[bytes]:
+    """Distinct phone-camera-sized JPEGs, so the result cache only hits when an image repeats."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        pixels = rng.integers(0, 256, (96, 128, 3), dtype=np.uint8)
+        image = Image.fromarray(pixels, "RGB").resize((1024, 768))
+        buf = io.BytesIO()
+        image.save(buf, "JPEG", quality=85)
+        images.append(buf.getvalue())
+    return images
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"Unknown endpoint '{name}' in --mix. Choose from: {', '.join(ENDPOINTS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def summarize(latencies: List[float], errors: int, duration: float) -> Dict[str, float]:
+    ms = np.array(latencies) * 1000.0 if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / duration, 2),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def seed_database(users: int, history_per_user: int) -> List[str]:
+    """Create the admin and regular users plus some chat history. Returns the usernames."""
+    import models
+    import security
+    from database import SessionLocal
+
+    password_hash = security.get_password_hash("loadtest")
+    db = SessionLocal()
+    try:
+        names = ["admin"] + [f"user{i}" for i in range(users)]
+        accounts = [
+            models.User(
+                email=f"{name}@loadtest.example.com", username=name, hashed_password=password_hash,
+                is_admin=name == "admin", history_count=history_per_user
+            )
+            for name in names
+        ]
+        db.add_all(accounts)
+        db.flush()
+        for account in accounts:
+            db.add_all(
+                models.ChatHistory(user_id=account.id, message=f"question {i}", response=f"answer {i}")
+                for i in range(history_per_user)
+            )
+        db.commit()
+        return names
+    finally:
+        db.close()
+
+
+async def run(args) -> Dict:
+    import httpx
+    import main
+    import detection_utils
+
+    fake_detector = FakeDetector(args.detector_latency_ms, args.detector_per_image_ms, main.DETECTOR_MAX_BATCH_SIZE)
+
+    def load_detector():
+        detection_utils.swap_detector(fake_detector)
+
+    main.load_detector = load_detector
+
+    images = make_images(args.images, args.seed)
+    weights = parse_mix(args.mix)
+    names, choices = list(weights), list(weights.values())
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+
+    async with main.lifespan(main.app):
+        while detection_utils.detector_state != "ready":
+            await asyncio.sleep(0.01)
+        usernames = seed_database(args.users, args.history)
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=120.0) as client:
+            tokens = {}
+            for name in usernames:
+                response = await client.post("/token", data={"username": name, "password": "loadtest"})
+                response.raise_for_status()
+                tokens[name] = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+            async def request(op: str, rng: random.Random):
+                user = f"user{rng.randrange(args.users)}"
+                if op == "token":
+                    return await client.post("/token", data={"username": user, "password": "loadtest"})
+                if op == "detect":
+                    image = images[rng.randrange(len(images))]
+                    return await client.post("/detect", files={"file": ("photo.jpg", image, "image/jpeg")}, headers=tokens[user])
+                if op == "chat":
+                    return await client.post("/chat", json={"message": rng.choice(PROMPTS)}, headers=tokens[user])
+                if op == "history":
+                    return await client.get("/chat-history", params={"limit": 10}, headers=tokens[user])
+                return await client.get("/admin/users", params={"limit": 50}, headers=tokens["admin"])
+
+            async def client_loop(index: int, deadline: float, record: bool):
+                rng = random.Random(args.seed * 1000 + index)
+                while time.perf_counter() < deadline:
+                    op = rng.choices(names, choices)[0]
+                    start = time.perf_counter()
+                    try:
+                        response = await request(op, rng)
+                        ok = response.status_code < 400
+                    except Exception:
+                        ok = False
+                    if record:
+                        latencies[op].append(time.perf_counter() - start)
+                        if not ok:
+                            errors[op] += 1
+
+            if args.warmup > 0:
+                deadline = time.perf_counter() + args.warmup
+                await asyncio.gather(*(client_loop(i, deadline, False) for i in range(args.concurrency)))
+
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*(client_loop(i, deadline, True) for i in range(args.concurrency)))
+            duration = time.perf_counter() - started
+
+            batcher_stats = detection_utils.get_batcher().stats()
+            gateway_stats = main.get_gateway().stats()
+            writer = main.history_writer.history_writer
+            history_stats = writer.stats() if writer else None
+
+    all_latencies = [latency for op in latencies for latency in latencies[op]]
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "duration_s": round(duration, 2),
+        "total": summarize(all_latencies, sum(errors.values()), duration),
+        "endpoints": {ENDPOINTS[op]: summarize(latencies[op], errors[op], duration) for op in names if op in latencies},
+        "batcher": {key: batcher_stats[key] for key in ("batches", "images", "average_batch_size", "average_queue_wait_ms", "rejected")},
+        "llm": {key: gateway_stats[key] for key in ("calls", "failures", "timeouts", "rejected", "average_latency_ms", "average_queue_wait_ms")},
+        "history_writer": {key: history_stats[key] for key in ("backlog", "written", "batches", "dropped", "average_batch_size", "average_flush_ms")} if history_stats else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds of measured load")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds of unmeasured load first")
+    parser.add_argument("--concurrency", type=int, default=32, help="Concurrent clients")
+    parser.add_argument("--mix", default="detect=5,chat=2,history=2,token=1,admin=1", help="Weighted endpoint mix")
+    parser.add_argument("--users", type=int, default=16, help="Regular users to spread requests over")
+    parser.add_argument("--history", type=int, default=50, help="Chat history rows seeded per user")
+    parser.add_argument("--images", type=int, default=64, help="Distinct images in the /detect pool")
+    parser.add_argument("--detector-latency-ms", type=float, default=20.0, help="Fake forward pass time per batch")
+    parser.add_argument("--detector-per-image-ms", type=float, default=2.0, help="Extra fake forward time per image")
+    parser.add_argument("--llm-latency-ms", type=float, default=500.0, help="Local LLM provider answer time")
+    parser.add_argument("--result-cache", action="store_true", help="Keep the detection result cache on (off by default)")
+    parser.add_argument("--no-advice-cache", action="store_true", help="Ask the LLM on every /detect")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    args = parser.parse_args()
+
+    # Settings main.py reads at import time; the database lands in the temp working directory
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ["LLM_PROVIDER"] = "local"
+    os.environ["LOCAL_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["DETECTOR_WARMUP"] = "0"
+    os.environ["DETECTOR_WORKERS"] = "0"
+    os.environ["RESULT_CACHE_SIZE"] = os.environ.get("RESULT_CACHE_SIZE", "1024") if args.result_cache else "0"
+    if args.no_advice_cache:
+        os.environ["ADVICE_CACHE"] = "0"
+    output = os.path.abspath(args.output) if args.output else None
+
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as workdir:
+        os.chdir(workdir)
+        report = asyncio.run(run(args))
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""
+Convert the Keras model (my_model.h5) into an artifact for a faster inference backend.
+
+Usage:
+    python convert_model.py tflite            # writes my_model.tflite
+    python convert_model.py onnx              # writes my_model.onnx (requires tf2onnx)
+    python convert_model.py tflite --quantize # dynamic-range quantized TFLite model
+
+Then start the API with DETECTOR_BACKEND=tflite or DETECTOR_BACKEND=onnx.
+"""
+import argparse
+import os
+
+from inference_backends import MODEL_FILES, load_keras_model
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def convert_to_tflite(model, output_path: str, quantize: bool = False):
+    """Convert a Keras model to a TFLite flatbuffer."""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+
+
+def convert_to_onnx(model, output_path: str, opset: int = 13):
+    """Convert a Keras model to ONNX with a dynamic batch dimension."""
+    import tensorflow as tf
+    try:
+        import tf2onnx
+    except ImportError:
+        raise ImportError("ONNX conversion requires tf2onnx (pip install tf2onnx)")
+
+    input_signature = [tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name="input")]
+    tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=opset, output_path=output_path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert the Keras model for the tflite or onnx backend")
+    parser.add_argument("format", choices=["tflite", "onnx"], help="Target backend")
+    parser.add_argument("--input", default=os.path.join(API_DIR, MODEL_FILES["keras"]), help="Path to the Keras .h5 model")
+    parser.add_argument("--output", help="Output path (defaults to the backend's model file in the API folder)")
+    parser.add_argument("--quantize", action="store_true", help="Apply dynamic-range quantization (tflite only)")
+    parser.add_argument("--opset", type=int, default=13, help="ONNX opset version (onnx only)")
+    args = parser.parse_args()
+
+    output_path = args.output or os.path.join(API_DIR, MODEL_FILES[args.format])
+    model = load_keras_model(args.input)
+
+    if args.format == "tflite":
+        convert_to_tflite(model, output_path, quantize=args.quantize)
+    else:
+        convert_to_onnx(model, output_path, opset=args.opset)
+
+    print(f"Wrote {args.format} model to {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,108 +1,278 @@
-import tensorflow as tf
-import tensorflow_hub as hub
 import numpy as np
 from PIL import Image
 import io
 import time
 import os
-from typing import Tuple, List, Dict, Any
+import json
+import shutil
+import hashlib
+import queue
+import threading
+import logging
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+from typing import Tuple, List, Dict, Any, Callable, Optional, Union, NamedTuple, ContextManager, BinaryIO
 
-# Use TensorFlow's built-in keras instead of tf-keras
-keras = tf.keras
+from inference_backends import load_backend
+from timing import Timings, detection_stages
+
+logger = logging.getLogger(__name__)
+
+# Encoded image bytes, or a seekable binary file holding them
+ImageSource = Union[bytes, BinaryIO]
+
+# What a batch returns per image: predictions, confidence scores, processing time and stage timings
+BatchOutput = Tuple[List[Dict[str, Any]], List[float], float, Timings]
+
+class Detection(NamedTuple):
+    """Result of detecting one image, as delivered to /detect callers."""
+    predictions: List[Dict[str, Any]]
+    confidence_scores: List[float]
+    processing_time: float
+    model_version: str
+    # Seconds spent in each pipeline stage (queue, decode, resize, normalize, inference, postprocess)
+    timings: Optional[Dict[str, float]] = None
+
+def preprocess_into(image_data: ImageSource, image_size: Tuple[int, int], out: np.ndarray, timings: Optional[Timings] = None):
+    """
+    Decode, resize and normalize an image straight into `out`, an (H, W, 3) float32 array.
+
+    `image_data` is either the encoded bytes or a seekable binary file (such as an
+    upload's spooled temp file), which is decoded in place without copying it to memory.
+
+    JPEGs are decoded at a reduced scale (1/2, 1/4 or 1/8) that is still at least
+    image_size, so large photos never get decoded at full resolution.
+    When `timings` is given, the decode, resize and normalize stages are added to it.
+    """
+    height, width = image_size
+    try:
+        if isinstance(image_data, (bytes, bytearray, memoryview)):
+            image_data = io.BytesIO(image_data)
+        else:
+            image_data.seek(0)
+        start = time.perf_counter()
+        image = Image.open(image_data)
+        image.draft("RGB", (width, height))
+        image.load()
+
+        # Convert to RGB if necessary
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        decoded = time.perf_counter()
+
+        if image.size != (width, height):
+            image = image.resize((width, height), reducing_gap=3.0)
+        resized = time.perf_counter()
+
+        # Normalize to [0, 1] in float32 directly into the output buffer
+        np.multiply(np.asarray(image), np.float32(1.0 / 255.0), out=out, dtype=np.float32)
+        if timings is not None:
+            timings.add("decode", decoded - start)
+            timings.add("resize", resized - decoded)
+            timings.add("normalize", time.perf_counter() - resized)
+    except Exception as e:
+        # Bad uploads are reported to their caller; only log them when debugging
+        logger.debug("Error in preprocess_image: %s", e)
+        raise Exception(f"Error preprocessing image: {str(e)}")
+
+def supported_batch_sizes(max_batch_size: int) -> Tuple[int, ...]:
+    """Powers of two up to max_batch_size, plus max_batch_size itself."""
+    sizes = []
+    size = 1
+    while size < max_batch_size:
+        sizes.append(size)
+        size *= 2
+    sizes.append(max_batch_size)
+    return tuple(sizes)
+
+def padded_batch_size(batch_sizes: Tuple[int, ...], batch_size: int) -> int:
+    """Smallest supported batch size that fits `batch_size` images."""
+    for size in batch_sizes:
+        if size >= batch_size:
+            return size
+    return batch_size
+
+def postprocess_predictions(predictions: np.ndarray) -> Tuple[List[Dict[str, Any]], List[float]]:
+    """Turn the raw model output for one image into results and confidence scores."""
+    results = []
+    confidence_scores = []
+
+    if len(predictions.shape) == 2:
+        # For detection models with multiple outputs
+        for pred in predictions:
+            confidence = float(pred.max())
+            class_idx = int(pred.argmax())
+            results.append({
+                "class_id": class_idx,
+                "class_name": f"class_{class_idx}",
+                "confidence": confidence
+            })
+            confidence_scores.append(confidence)
+    else:
+        # For single classification output
+        class_idx = np.argmax(predictions[0])
+        confidence = float(predictions[0][class_idx])
+        results.append({
+            "class_id": int(class_idx),
+            "class_name": f"class_{class_idx}",
+            "confidence": confidence
+        })
+        confidence_scores.append(confidence)
+
+    return results, confidence_scores
+
+def run_batch(
+    images: List[ImageSource],
+    image_size: Tuple[int, int],
+    batch_sizes: Tuple[int, ...],
+    buffer: np.ndarray,
+    forward: Callable[[np.ndarray], np.ndarray]
+) -> List[Union[BatchOutput, Exception]]:
+    """
+    Preprocess `images` into `buffer`, run `forward` once on the padded batch and postprocess each row.
+    Each image gets its own stage timings; the forward pass is shared, so every image reports its full time.
+    The caller must hold exclusive use of `buffer` for the duration of the call.
+    """
+    start_time = time.time()
+    outputs: List[Any] = [None] * len(images)
+    timings = [Timings() for _ in images]
+
+    # Preprocess every image on its own so a bad upload only fails its own caller
+    indices = []
+    for i, image_data in enumerate(images):
+        try:
+            preprocess_into(image_data, image_size, buffer[len(indices)], timings[i])
+            indices.append(i)
+        except Exception as e:
+            outputs[i] = e
+
+    if not indices:
+        return outputs
+
+    # Pad with blank images up to a compiled batch size
+    padded_size = padded_batch_size(batch_sizes, len(indices))
+    buffer[len(indices):padded_size] = 0.0
+    forward_start = time.perf_counter()
+    try:
+        predictions = forward(buffer[:padded_size])
+    except Exception as e:
+        logger.error(f"Error in predict_batch: {str(e)}")
+        raise Exception(f"Error during image detection: {str(e)}")
+    inference_time = time.perf_counter() - forward_start
+
+    processing_time = time.time() - start_time
+    for row, i in enumerate(indices):
+        postprocess_start = time.perf_counter()
+        results, confidence_scores = postprocess_predictions(predictions[row:row + 1])
+        timings[i].add("inference", inference_time)
+        timings[i].add("postprocess", time.perf_counter() - postprocess_start)
+        outputs[i] = (results, confidence_scores, processing_time, timings[i])
+
+    return outputs
+
+def model_version(model_path: str, label: str) -> str:
+    """Identify a model artifact by a label (registry version or backend) and a hash of its contents."""
+    digest = hashlib.sha256()
+    with open(model_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return f"{label}-{digest.hexdigest()[:12]}"
 
 class ImageDetector:
     
-    def __init__(self, model_path: str):
-        """Initialize the detector with a model path."""
-        print(f"Attempting to load model from: {model_path}")
+    def __init__(self, model_path: str, backend: str = "keras", max_batch_size: int = 8, version: Optional[str] = None):
+        """
+        Initialize the detector with a model path and the inference backend to run it on.
+        `version` is the registry version the model was loaded from, if any.
+        """
+        logger.info(f"Attempting to load model from: {model_path}")
         
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Model file not found at {model_path}")
             
         try:
-            print("Loading model...")
-            try:
-                # First try loading directly with proper signatures
-                self.model = keras.models.load_model(model_path, custom_objects={
-                    'KerasLayer': hub.KerasLayer,
-                    'keras_layer': hub.KerasLayer
-                })
-                print("Model loaded successfully with direct loading")
-            except Exception as load_error:
-                print(f"Direct loading failed, trying alternative approach: {str(load_error)}")
-                # If that fails, try recreating the model with compatible layer
-                hub_url = "https://www.kaggle.com/models/google/mobilenet-v2/TensorFlow2/035-128-classification/2"
-                
-                # Create the model using Keras functional API
-                inputs = keras.layers.Input(shape=(224, 224, 3))
-                hub_layer = hub.KerasLayer(hub_url, trainable=False, output_shape=[1280])
-                features = hub_layer(inputs)
-                outputs = keras.layers.Dense(1000, activation='softmax')(features)
-                
-                self.model = keras.Model(inputs, outputs)
-                
-                # Try to load weights
-                try:
-                    self.model.load_weights(model_path)
-                    print("Weights loaded successfully")
-                except Exception as weight_error:
-                    print(f"Weight loading failed: {str(weight_error)}")
-                    # Initialize from scratch if weight loading fails
-                    self.model.compile(
-                        optimizer='adam',
-                        loss='sparse_categorical_crossentropy',
-                        metrics=['accuracy']
-                    )
-                print("Model created successfully with alternative approach")
-                
-            # Print model summary
-            print("\nModel Summary:")
-            self.model.summary()
+            self.backend = load_backend(backend, model_path)
+            self.model_version = model_version(model_path, version or backend)
+            logger.info(f"Model version: {self.model_version}")
             
             # Get input shape from model
-            input_shape = self.model.input_shape
-            print(f"\nModel input shape: {input_shape}")
+            input_shape = self.backend.input_shape
+            logger.info(f"Model input shape: {input_shape}")
             
-            if input_shape is not None and len(input_shape) == 4:
+            if input_shape is not None and len(input_shape) == 4 and input_shape[1] and input_shape[2]:
                 self.image_size = (input_shape[1], input_shape[2])
             else:
                 self.image_size = (224, 224)  # Default size
                 
-            print(f"Using image size: {self.image_size}")
+            logger.info(f"Using image size: {self.image_size}")
+
+            # Preprocessed batches are written into this buffer instead of fresh arrays
+            self._buffer: Optional[np.ndarray] = None
+            self._buffer_lock = threading.Lock()
+
+            # Batches are padded up to one of these sizes so every forward pass
+            # hits a serving function that was compiled for its exact shape
+            self.batch_sizes = supported_batch_sizes(max_batch_size)
+            self.backend.prepare(self.batch_sizes)
+            self.warmup_seconds: Optional[float] = None
             
         except Exception as e:
-            print(f"Error details: {str(e)}")
+            logger.error(f"Error details: {str(e)}")
             raise Exception(f"Failed to load model: {str(e)}")
         
-    def preprocess_image(self, image_data: bytes) -> np.ndarray:
-        """Preprocess the image for model input."""
-        try:
-            # Read image from bytes
-            image = Image.open(io.BytesIO(image_data))
-            print(f"Loaded image: size={image.size}, mode={image.mode}")
-            
-            # Convert to RGB if necessary
-            if image.mode != "RGB":
-                image = image.convert("RGB")
-                print("Converted image to RGB")
-            
-            # Resize image
-            image = image.resize(self.image_size)
-            print(f"Resized image to {self.image_size}")
-            
-            # Convert to numpy array and preprocess
-            img_array = keras.preprocessing.image.img_to_array(image)
-            img_array = np.expand_dims(img_array, axis=0)
-            img_array = img_array / 255.0  # Normalize
-            
-            print(f"Preprocessed image shape: {img_array.shape}")
-            return img_array
-            
-        except Exception as e:
-            print(f"Error in preprocess_image: {str(e)}")
-            raise Exception(f"Error preprocessing image: {str(e)}")
+    def preprocess_image(self, image_data: ImageSource, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Preprocess the image for model input.
+        Writes into `out` (an (H, W, 3) float32 array) when given, otherwise returns a new (1, H, W, 3) array.
+        """
+        if out is None:
+            out = np.empty((1, self.image_size[0], self.image_size[1], 3), dtype=np.float32)
+            preprocess_into(image_data, self.image_size, out[0])
+        else:
+            preprocess_into(image_data, self.image_size, out)
+        return out
+
+    def warmup(self) -> float:
+        """Run synthetic batches of every supported size through the model. Returns the time taken."""
+        start_time = time.time()
+        for batch_size in self.batch_sizes:
+            self.backend.predict(np.zeros((batch_size, self.image_size[0], self.image_size[1], 3), dtype=np.float32))
+        self.warmup_seconds = time.time() - start_time
+        logger.info(f"Model warm-up for batch sizes {list(self.batch_sizes)} took {self.warmup_seconds:.2f} seconds")
+        return self.warmup_seconds
+
+    def _batch_buffer(self, batch_size: int) -> np.ndarray:
+        """Return the reusable input buffer, growing it if the batch is larger than before."""
+        if self._buffer is None or self._buffer.shape[0] < batch_size:
+            self._buffer = np.empty((batch_size, self.image_size[0], self.image_size[1], 3), dtype=np.float32)
+        return self._buffer
     
-    def predict(self, image_data: bytes) -> Tuple[List[Dict[str, Any]], List[float], float]:
+    def predict_batch(self, images: List[ImageSource]) -> List[Union[BatchOutput, Exception]]:
+        """
+        Perform detection on several images with a single forward pass.
+        Returns one (predictions, confidence scores, processing time, stage timings) tuple per image,
+        or the exception raised while preprocessing that image.
+        """
+        # The input buffer is reused between batches, so only one batch may use it at a time
+        with self._buffer_lock:
+            buffer = self._batch_buffer(padded_batch_size(self.batch_sizes, len(images)))
+            return run_batch(images, self.image_size, self.batch_sizes, buffer, self.backend.predict)
+
+    def describe(self) -> Dict[str, Any]:
+        """Summary of the loaded model for status endpoints."""
+        return {
+            "model_version": self.model_version,
+            "backend": self.backend.name,
+            "batch_sizes": list(self.batch_sizes),
+            "warmup_seconds": self.warmup_seconds,
+        }
+
+    def close(self):
+        """Release the model."""
+        self.backend.close()
+
+    def predict(self, image_data: ImageSource) -> Tuple[List[Dict[str, Any]], List[float], float]:
         """
         Perform detection on the input image.
         Returns predictions, confidence scores, and processing time.
@@ -110,68 +280,528 @@ class ImageDetector:
         start_time = time.time()
         
         try:
-            print("\nStarting prediction...")
+            logger.debug("Starting prediction...")
             # Preprocess image
             processed_image = self.preprocess_image(image_data)
             
             # Make prediction
-            print("Running model inference...")
-            predictions = self.model.predict(processed_image, verbose=0)
-            print(f"Raw prediction shape: {predictions.shape if isinstance(predictions, np.ndarray) else 'not numpy array'}")
+            logger.debug("Running model inference...")
+            predictions = self.backend.predict(processed_image)
+            logger.debug("Raw prediction shape: %s", predictions.shape if isinstance(predictions, np.ndarray) else "not numpy array")
             
             # Process predictions
             results = []
             confidence_scores = []
             
             if isinstance(predictions, np.ndarray):
-                if len(predictions.shape) == 2:
-                    # For detection models with multiple outputs
-                    for pred in predictions:
-                        confidence = float(pred.max())
-                        class_idx = int(pred.argmax())
-                        results.append({
-                            "class_id": class_idx,
-                            "class_name": f"class_{class_idx}",
-                            "confidence": confidence
-                        })
-                        confidence_scores.append(confidence)
-                else:
-                    # For single classification output
-                    class_idx = np.argmax(predictions[0])
-                    confidence = float(predictions[0][class_idx])
-                    results.append({
-                        "class_id": int(class_idx),
-                        "class_name": f"class_{class_idx}",
-                        "confidence": confidence
-                    })
-                    confidence_scores.append(confidence)
+                results, confidence_scores = postprocess_predictions(predictions)
             
             processing_time = time.time() - start_time
-            print(f"Prediction completed in {processing_time:.2f} seconds")
+            logger.debug("Prediction completed in %.2f seconds", processing_time)
             
             return results, confidence_scores, processing_time
             
         except Exception as e:
-            print(f"Error in predict: {str(e)}")
+            logger.error(f"Error in predict: {str(e)}")
             raise Exception(f"Error during image detection: {str(e)}")
 
+
+class QueueFullError(Exception):
+    """Raised when the detection queue is full and the request should be retried later."""
+
+
+class _PendingImage:
+    """A queued image waiting to be picked up by the batch scheduler."""
+
+    __slots__ = ("image_data", "future", "enqueued_at")
+
+    def __init__(self, image_data: ImageSource):
+        self.image_data = image_data
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class BatchScheduler:
+    """
+    Gathers concurrent detection requests into batches.
+
+    A background thread waits for the first queued image, then keeps collecting
+    until either max_batch_size images are queued or max_wait_ms has passed,
+    runs one forward pass for the whole batch and resolves each caller's future
+    with a Detection.
+    The queue holds at most max_queue_size images; submit() raises
+    QueueFullError beyond that so callers can shed load instead of waiting.
+    With concurrency > 1, that many threads form and run batches in parallel,
+    which is what lets an InferencePool keep all of its workers busy.
+    """
+
+    def __init__(self, detector_source: Callable[[], ContextManager["ImageDetector"]], max_batch_size: int = 8, max_wait_ms: float = 5.0, max_queue_size: int = 64, concurrency: int = 1):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if max_wait_ms < 0:
+            raise ValueError("max_wait_ms must not be negative")
+        if max_queue_size < 1:
+            raise ValueError("max_queue_size must be at least 1")
+        if concurrency < 1:
+            raise ValueError("concurrency must be at least 1")
+
+        self.detector_source = detector_source
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_queue_size = max_queue_size
+        self.concurrency = concurrency
+
+        self._queue: "queue.Queue[Optional[_PendingImage]]" = queue.Queue(maxsize=max_queue_size)
+        self._threads: List[threading.Thread] = []
+        self._stats_lock = threading.Lock()
+        self._batch_sizes: Counter = Counter()
+        self._images = 0
+        self._rejected = 0
+        self._queue_wait_total = 0.0
+        self._queue_wait_max = 0.0
+
+    def start(self):
+        """Start the background batching threads."""
+        if self._threads:
+            return
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"detection-batcher-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0):
+        """Stop the batching threads after the images already queued are processed."""
+        if not self._threads:
+            return
+        # One stop marker per thread; each thread exits after taking one
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, image_data: ImageSource) -> Future:
+        """
+        Queue an image for detection and return a future for its result.
+        Raises QueueFullError immediately if the queue is at capacity.
+        """
+        if not self._threads:
+            raise Exception("Batch scheduler is not running")
+        pending = _PendingImage(image_data)
+        try:
+            self._queue.put_nowait(pending)
+        except queue.Full:
+            with self._stats_lock:
+                self._rejected += 1
+            raise QueueFullError(f"Detection queue is full ({self.max_queue_size} images waiting)")
+        return pending.future
+
+    def _collect(self, first: _PendingImage) -> Tuple[List[_PendingImage], bool]:
+        """Collect a batch starting with `first`. Returns the batch and whether a stop was requested."""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    item = self._queue.get(timeout=remaining)
+                else:
+                    item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stopping = self._collect(first)
+
+            # Drop callers that gave up while waiting in the queue
+            batch = [p for p in batch if p.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started_at = time.monotonic()
+            waits = [started_at - pending.enqueued_at for pending in batch]
+            with self._stats_lock:
+                self._batch_sizes[len(batch)] += 1
+                self._images += len(batch)
+                for waited in waits:
+                    self._queue_wait_total += waited
+                    self._queue_wait_max = max(self._queue_wait_max, waited)
+
+            try:
+                # Holding the detector for the whole batch lets a hot swap wait for it to finish
+                with self.detector_source() as detector:
+                    outputs = detector.predict_batch([p.image_data for p in batch])
+                    version = detector.model_version
+            except Exception as e:
+                for pending in batch:
+                    pending.future.set_exception(e)
+                continue
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Ran batch of %d images on %s in %.1f ms", len(batch), version, (time.monotonic() - started_at) * 1000.0)
+
+            for pending, waited, output in zip(batch, waits, outputs):
+                if isinstance(output, Exception):
+                    pending.future.set_exception(output)
+                else:
+                    results, confidence_scores, processing_time, timings = output
+                    timings = Timings(queue=waited, **timings)
+                    detection_stages.observe_all(timings)
+                    pending.future.set_result(Detection(results, confidence_scores, processing_time, version, timings))
+
+    def stats(self) -> Dict[str, Any]:
+        """Report the configuration, queue state and the batch sizes actually formed so far."""
+        with self._stats_lock:
+            batches = sum(self._batch_sizes.values())
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait_ms,
+                "max_queue_size": self.max_queue_size,
+                "concurrency": self.concurrency,
+                "queue_depth": self._queue.qsize(),
+                "rejected": self._rejected,
+                "batches": batches,
+                "images": self._images,
+                "average_batch_size": self._images / batches if batches else 0.0,
+                "batch_sizes": {str(size): count for size, count in sorted(self._batch_sizes.items())},
+                "average_queue_wait_ms": self._queue_wait_total / self._images * 1000.0 if self._images else 0.0,
+                "max_queue_wait_ms": self._queue_wait_max * 1000.0,
+            }
+
+class ResultCache:
+    """
+    LRU cache of detection results keyed by a hash of the uploaded bytes and the model version.
+
+    Entries expire after ttl_seconds. When disk_dir is set, results are also written
+    as small JSON files under disk_dir/<model_version>/ so they survive restarts.
+    use_model_version() moves the cache to a newly activated model, dropping every entry
+    stored for the previous one. Lookups and results for any other version are plain
+    misses and are discarded: during a hot swap, requests and batches that started on
+    the old model still finish after the new one is live, and must not move it back.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600.0, disk_dir: Optional[str] = None):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, Tuple[float, Tuple[List[Dict[str, Any]], List[float]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_version: Optional[str] = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_image(image_data: ImageSource) -> str:
+        if isinstance(image_data, (bytes, bytearray, memoryview)):
+            return hashlib.sha256(image_data).hexdigest()
+        image_data.seek(0)
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: image_data.read(1024 * 1024), b""):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+    def _use_model_version(self, version: str) -> List[str]:
+        """
+        Invalidate everything cached for a different model. Caller holds the lock.
+        Returns the disk directories to delete with _remove_dirs() once the lock is released.
+        """
+        if version == self._model_version:
+            return []
+        self._entries.clear()
+        self._model_version = version
+        if not self.disk_dir:
+            return []
+        return [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir) if name != version]
+
+    def use_model_version(self, version: str):
+        """Serve `version` from now on, invalidating everything cached for other versions."""
+        with self._lock:
+            stale = self._use_model_version(version)
+        self._remove_dirs(stale)
+
+    @staticmethod
+    def _remove_dirs(paths: List[str]):
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def _disk_path(self, digest: str, version: str) -> str:
+        return os.path.join(self.disk_dir, version, digest[:2], f"{digest}.json")
+
+    def _read_disk(self, digest: str, version: str) -> Optional[Tuple[float, Tuple[List[Dict[str, Any]], List[float]]]]:
+        path = self._disk_path(digest, version)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] < time.time():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        # Convert the wall-clock expiry back to the monotonic clock used in memory
+        expires_at = time.monotonic() + entry["expires_at"] - time.time()
+        return expires_at, (entry["predictions"], entry["confidence_scores"])
+
+    def _write_disk(self, digest: str, version: str, value: Tuple[List[Dict[str, Any]], List[float]]):
+        path = self._disk_path(digest, version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "expires_at": time.time() + self.ttl_seconds,
+                "predictions": value[0],
+                "confidence_scores": value[1],
+            }, f)
+        os.replace(tmp_path, path)
+
+    def get(self, digest: str, version: str) -> Optional[Tuple[List[Dict[str, Any]], List[float]]]:
+        """Return the cached (predictions, confidence_scores) for an image, or None."""
+        stale = []
+        with self._lock:
+            if self._model_version is None:
+                stale = self._use_model_version(version)
+            elif version != self._model_version:
+                self.misses += 1
+                return None
+            entry = self._entries.get(digest)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[digest]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                self.hits += 1
+                return entry[1]
+        # File I/O happens outside the lock, so lookups don't queue behind a slow disk
+        # or behind deleting a previous version's files
+        self._remove_dirs(stale)
+        entry = self._read_disk(digest, version) if self.disk_dir else None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.hits += 1
+            if version == self._model_version:
+                self._store(digest, entry)
+            return entry[1]
+
+    def _store(self, digest: str, entry: Tuple[float, Tuple[List[Dict[str, Any]], List[float]]]):
+        self._entries[digest] = entry
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def set(self, digest: str, version: str, predictions: List[Dict[str, Any]], confidence_scores: List[float]):
+        """Cache the detection result for an image."""
+        value = (predictions, confidence_scores)
+        stale = []
+        with self._lock:
+            if self._model_version is None:
+                stale = self._use_model_version(version)
+            elif version != self._model_version:
+                return
+            self._store(digest, (time.monotonic() + self.ttl_seconds, value))
+        self._remove_dirs(stale)
+        if self.disk_dir:
+            try:
+                self._write_disk(digest, version, value)
+            except OSError as e:
+                logger.warning(f"Could not write result cache entry: {str(e)}")
+
+    def clear(self):
+        """Drop every cached result, in memory and on disk."""
+        with self._lock:
+            self._entries.clear()
+            stale = [os.path.join(self.disk_dir, name) for name in os.listdir(self.disk_dir)] if self.disk_dir else []
+        self._remove_dirs(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "disk_dir": self.disk_dir,
+                "model_version": self._model_version,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
 # Initialize detector
 detector = None
+# One of "not_loaded", "loading", "ready" or "failed"; detector_error holds the failure reason
+detector_state = "not_loaded"
+detector_error: Optional[str] = None
+
+# Number of batches currently running on each detector, keyed by id(detector)
+_detector_users: Counter = Counter()
+_detector_condition = threading.Condition()
 
-def initialize_detector(model_path: str):
-    """Initialize the detector with the specified model."""
-    global detector
+def create_detector(model_path: str, backend: str = "keras", max_batch_size: int = 8, warmup: bool = True, workers: int = 0, version: Optional[str] = None):
+    """
+    Load a detector for the specified model and warm it up, without publishing it.
+    With workers > 0 the model runs in that many worker processes (see inference_pool.py).
+    """
+    logger.info(f"Initializing detector with model: {model_path} ({backend} backend)")
+    if workers > 0:
+        from inference_pool import InferencePool
+        return InferencePool(model_path, backend=backend, workers=workers, max_batch_size=max_batch_size, warmup=warmup, version=version)
+    new_detector = ImageDetector(model_path, backend=backend, max_batch_size=max_batch_size, version=version)
+    if warmup:
+        new_detector.warmup()
+    return new_detector
+
+def initialize_detector(model_path: str, backend: str = "keras", max_batch_size: int = 8, warmup: bool = True, workers: int = 0, version: Optional[str] = None):
+    """Initialize the detector with the specified model, warming it up before it serves requests."""
+    global detector_state, detector_error
+    detector_state = "loading"
+    detector_error = None
     try:
-        print(f"\nInitializing detector with model: {model_path}")
-        detector = ImageDetector(model_path)
-        print("Detector initialized successfully")
+        new_detector = create_detector(model_path, backend=backend, max_batch_size=max_batch_size, warmup=warmup, workers=workers, version=version)
+        old_detector = swap_detector(new_detector)
+        if old_detector is not None:
+            retire_detector(old_detector)
+        logger.info("Detector initialized successfully")
         return True
     except Exception as e:
-        print(f"Error initializing detector: {str(e)}")
+        detector_state = "failed"
+        detector_error = str(e)
+        logger.error(f"Error initializing detector: {str(e)}")
         return False
 
 def get_detector() -> ImageDetector:
     """Get the initialized detector."""
     if detector is None:
+        if detector_state == "loading":
+            raise Exception("Model is still loading. Please try again shortly.")
         raise Exception("Detector not initialized. Please make sure the model file exists and is valid.")
-    return detector
\ No newline at end of file
+    return detector
+
+@contextmanager
+def use_detector():
+    """Borrow the active detector for one batch; a detector being swapped out is not closed while borrowed."""
+    with _detector_condition:
+        current = get_detector()
+        _detector_users[id(current)] += 1
+    try:
+        yield current
+    finally:
+        with _detector_condition:
+            _detector_users[id(current)] -= 1
+            if _detector_users[id(current)] <= 0:
+                del _detector_users[id(current)]
+                _detector_condition.notify_all()
+
+def swap_detector(new_detector) -> Optional[ImageDetector]:
+    """Atomically make `new_detector` the active detector. Returns the previous one."""
+    global detector, detector_state
+    with _detector_condition:
+        old_detector = detector
+        detector = new_detector
+        detector_state = "ready"
+    # Only the active model moves the result cache to a new version
+    if result_cache is not None:
+        result_cache.use_model_version(new_detector.model_version)
+    return old_detector
+
+def retire_detector(old_detector, timeout: float = 60.0):
+    """Wait for the batches still running on a swapped-out detector, then release it."""
+    with _detector_condition:
+        finished = _detector_condition.wait_for(lambda: _detector_users[id(old_detector)] == 0, timeout)
+    if not finished:
+        logger.warning(f"Closing model {old_detector.model_version} with batches still running")
+    old_detector.close()
+    logger.info(f"Released model {old_detector.model_version}")
+
+# Initialize batch scheduler
+batcher = None
+
+def initialize_batcher(max_batch_size: int = 8, max_wait_ms: float = 5.0, max_queue_size: int = 64, concurrency: int = 1) -> BatchScheduler:
+    """Start the batch scheduler in front of the detector."""
+    global batcher
+    if batcher is not None:
+        batcher.stop()
+    batcher = BatchScheduler(
+        use_detector,
+        max_batch_size=max_batch_size,
+        max_wait_ms=max_wait_ms,
+        max_queue_size=max_queue_size,
+        concurrency=concurrency
+    )
+    batcher.start()
+    logger.info(f"Batch scheduler started (max_batch_size={max_batch_size}, max_wait_ms={max_wait_ms}, max_queue_size={max_queue_size}, concurrency={concurrency})")
+    return batcher
+
+def get_batcher() -> BatchScheduler:
+    """Get the running batch scheduler."""
+    if batcher is None:
+        raise Exception("Batch scheduler not initialized.")
+    return batcher
+
+# Initialize result cache
+result_cache = None
+
+def initialize_result_cache(max_entries: int = 1024, ttl_seconds: float = 3600.0, disk_dir: Optional[str] = None) -> ResultCache:
+    """Create the detection result cache."""
+    global result_cache
+    result_cache = ResultCache(max_entries=max_entries, ttl_seconds=ttl_seconds, disk_dir=disk_dir)
+    if detector is not None:
+        result_cache.use_model_version(detector.model_version)
+    logger.info(f"Result cache enabled (max_entries={max_entries}, ttl_seconds={ttl_seconds}, disk_dir={disk_dir})")
+    return result_cache
+
+def submit_detection(image_data: ImageSource, digest: Optional[str] = None) -> Future:
+    """
+    Detect an image through the result cache and the batch scheduler.
+    Pass `digest` (the SHA-256 hex of the image) when it was already computed while reading the upload.
+    Returns a future resolving to a Detection.
+    """
+    if result_cache is None:
+        return get_batcher().submit(image_data)
+
+    start_time = time.time()
+    version = get_detector().model_version
+    if digest is None:
+        digest = ResultCache.hash_image(image_data)
+    cached = result_cache.get(digest, version)
+    if cached is not None:
+        future = Future()
+        elapsed = time.time() - start_time
+        detection_stages.observe("cache", elapsed)
+        future.set_result(Detection(cached[0], cached[1], elapsed, version, Timings(cache=elapsed)))
+        return future
+
+    future = get_batcher().submit(image_data)
+
+    def store(done: Future):
+        if not done.cancelled() and done.exception() is None:
+            detection = done.result()
+            # A batch that ran on a model swapped out meanwhile has nothing to add to the cache
+            if detector is None or detection.model_version != detector.model_version:
+                return
+            result_cache.set(digest, detection.model_version, detection.predictions, detection.confidence_scores)
+
+    future.add_done_callback(store)
+    return future
@@ -0,0 +1,47 @@
+import logging
+from collections import Counter
+from typing import Iterable, Optional, Union
+
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+import models
+
+logger = logging.getLogger(__name__)
+
+# users.history_count holds the number of chat_histories rows of each user, so listing
+# a page of history doesn't have to count them. Whatever inserts history rows adds to
+# the counter in the same transaction; rebuild_history_counts() repairs any drift
+# (rows written by other tools, a failed deploy, manual edits).
+
+_users = models.User.__table__
+
+
+def add_history_counts(db: Union[Session, Connection], user_ids: Iterable[Optional[int]]):
+    """Add one to the counter of each user id given, for rows inserted in the current transaction."""
+    counts = Counter(user_id for user_id in user_ids if user_id is not None)
+    if not counts:
+        return
+    db.execute(
+        update(_users)
+        .where(_users.c.id == bindparam("user_id"))
+        # updated_at keeps meaning "profile last changed"; its onupdate would stamp every chat
+        .values(history_count=_users.c.history_count + bindparam("added"), updated_at=_users.c.updated_at),
+        [{"user_id": user_id, "added": added} for user_id, added in counts.items()]
+    )
+
+
+def rebuild_history_counts(db: Union[Session, Connection]) -> int:
+    """Recount every user's history and fix the counters that are off. Returns how many were fixed."""
+    counted = select(func.count(models.ChatHistory.id))\
+        .where(models.ChatHistory.user_id == _users.c.id)\
+        .scalar_subquery()
+    result = db.execute(
+        update(_users)
+        .where(_users.c.history_count != counted)
+        .values(history_count=counted, updated_at=_users.c.updated_at)
+    )
+    if result.rowcount:
+        logger.warning(f"Rebuilt the chat history counters of {result.rowcount} users")
+    return result.rowcount
@@ -0,0 +1,200 @@
+import logging
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import models
+from history_counts import add_history_counts
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryWriter:
+    """
+    Records chat history rows in the background.
+
+    record() only puts the row on a queue; a writer thread collects rows for up to
+    flush_interval_ms (or until max_batch_size are waiting) and inserts them in one
+    transaction. Rows appear in GET /chat-history up to flush_interval_ms after the
+    response was sent. When more than max_backlog rows are waiting, new ones are
+    dropped and counted rather than slowing down requests.
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], flush_interval_ms: float = 200.0, max_batch_size: int = 500, max_backlog: int = 10000):
+        if flush_interval_ms < 0:
+            raise ValueError("flush_interval_ms must not be negative")
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+        if max_backlog < 1:
+            raise ValueError("max_backlog must be at least 1")
+
+        self.session_factory = session_factory
+        self.flush_interval_ms = flush_interval_ms
+        self.max_batch_size = max_batch_size
+        self.max_backlog = max_backlog
+
+        self._queue: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max_backlog)
+        self._thread: Optional[threading.Thread] = None
+        self._stats_lock = threading.Lock()
+        # Rows recorded but not yet written, including those the writer is collecting
+        self._backlog = 0
+        self._written = 0
+        self._batches = 0
+        self._failed = 0
+        self._dropped = 0
+        self._flush_time_total = 0.0
+
+    def start(self):
+        """Start the writer thread."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Write every queued row, then stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            logger.warning(f"History writer did not finish within {timeout}s; {self._queue.qsize()} rows not written")
+        self._thread = None
+
+    def record(
+        self,
+        user_id: int,
+        message: str,
+        response: str,
+        image_path: Optional[str] = None,
+        model_version: Optional[str] = None
+    ) -> bool:
+        """Queue a chat history row. Returns False if it was dropped because the backlog is full."""
+        row = {
+            "user_id": user_id,
+            "message": message,
+            "response": response,
+            "image_path": image_path,
+            "model_version": model_version,
+            # Stamped now so the history keeps request order however late the insert runs
+            "created_at": datetime.utcnow(),
+        }
+        with self._stats_lock:
+            try:
+                self._queue.put_nowait(row)
+            except queue.Full:
+                self._dropped += 1
+                return False
+            self._backlog += 1
+        return True
+
+    def _collect(self, first: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], bool]:
+        """Collect rows starting with `first`. Returns the rows and whether a stop was requested."""
+        rows = [first]
+        deadline = time.monotonic() + self.flush_interval_ms / 1000.0
+        while len(rows) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                row = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is None:
+                return rows, True
+            rows.append(row)
+        return rows, False
+
+    def _write(self, rows: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        db = self.session_factory()
+        try:
+            db.execute(insert(models.ChatHistory), rows)
+            add_history_counts(db, (row["user_id"] for row in rows))
+            db.commit()
+        except Exception:
+            db.rollback()
+            logger.exception(f"Could not write {len(rows)} chat history rows")
+            with self._stats_lock:
+                self._failed += len(rows)
+                self._backlog -= len(rows)
+            return
+        finally:
+            db.close()
+        with self._stats_lock:
+            self._backlog -= len(rows)
+            self._written += len(rows)
+            self._batches += 1
+            self._flush_time_total += time.perf_counter() - started
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                stop = True
+                rows = []
+            else:
+                rows, stop = self._collect(first)
+            if stop:
+                # Drain whatever is still queued behind the stop marker
+                while True:
+                    try:
+                        row = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if row is not None:
+                        rows.append(row)
+            for i in range(0, len(rows), self.max_batch_size):
+                self._write(rows[i:i + self.max_batch_size])
+            if stop:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "running": self._thread is not None,
+                "flush_interval_ms": self.flush_interval_ms,
+                "max_batch_size": self.max_batch_size,
+                "max_backlog": self.max_backlog,
+                "backlog": self._backlog,
+                "written": self._written,
+                "batches": self._batches,
+                "failed": self._failed,
+                "dropped": self._dropped,
+                "average_batch_size": self._written / self._batches if self._batches else 0.0,
+                "average_flush_ms": self._flush_time_total / self._batches * 1000.0 if self._batches else 0.0,
+            }
+
+
+# Initialize history writer
+history_writer: Optional[HistoryWriter] = None
+
+def initialize_history_writer(session_factory: Callable[[], Session], flush_interval_ms: float = 200.0, max_batch_size: int = 500, max_backlog: int = 10000) -> HistoryWriter:
+    """Start the background chat history writer."""
+    global history_writer
+    if history_writer is not None:
+        history_writer.stop()
+    history_writer = HistoryWriter(
+        session_factory,
+        flush_interval_ms=flush_interval_ms,
+        max_batch_size=max_batch_size,
+        max_backlog=max_backlog
+    )
+    history_writer.start()
+    logger.info(f"History writer started (flush_interval_ms={flush_interval_ms}, max_batch_size={max_batch_size}, max_backlog={max_backlog})")
+    return history_writer
+
+def record_history(user_id: int, message: str, response: str, image_path: Optional[str] = None, model_version: Optional[str] = None):
+    """Queue a chat history row if the history writer is running."""
+    if history_writer is not None:
+        history_writer.record(user_id, message, response, image_path=image_path, model_version=model_version)
+
+def stop_history_writer():
+    """Flush the remaining rows and stop the writer."""
+    global history_writer
+    if history_writer is not None:
+        history_writer.stop()
+        history_writer = None
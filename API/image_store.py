@@ -0,0 +1,281 @@
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+from PIL import Image
+
+from detection_utils import ImageSource, ResultCache
+
+logger = logging.getLogger(__name__)
+
+_DIGEST_RE = re.compile(r"^[0-9a-f]{64}$")
+
+# Variant name -> (file name, media type). The original keeps its own format, see _ORIGINAL_FORMATS.
+VARIANTS = {
+    "thumbnail": ("thumbnail.jpg", "image/jpeg"),
+    "model": ("model.png", "image/png"),
+}
+_ORIGINAL_FORMATS = {
+    "JPEG": ("original.jpg", "image/jpeg"),
+    "PNG": ("original.png", "image/png"),
+    "GIF": ("original.gif", "image/gif"),
+    "BMP": ("original.bmp", "image/bmp"),
+    "WEBP": ("original.webp", "image/webp"),
+    "TIFF": ("original.tif", "image/tiff"),
+}
+_DEFAULT_ORIGINAL = ("original.bin", "application/octet-stream")
+
+
+class ImageStore:
+    """
+    Content-addressed store for uploaded images.
+
+    Each image lives in root/<first two hex digits>/<sha256>/ as the original upload,
+    a JPEG thumbnail and a lossless PNG at the model's input resolution. put() only
+    writes the original; decoding it for the other two happens on a background thread,
+    so storing costs a request little more than a file copy. Uploading the same bytes
+    again only finds the existing directory. Images are referenced from chat history
+    by their digest; collect_garbage() removes the ones no row refers to any more.
+    """
+
+    def __init__(self, root: str, thumbnail_size: int = 256):
+        self.root = root
+        self.thumbnail_size = thumbnail_size
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-variants")
+        # Digests whose variants are waiting to be built
+        self._pending: Set[str] = set()
+        self.stored = 0
+        self.deduplicated = 0
+        self.failed = 0
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def is_digest(value: str) -> bool:
+        return bool(_DIGEST_RE.match(value or ""))
+
+    def _dir(self, digest: str) -> str:
+        if not self.is_digest(digest):
+            raise ValueError(f"Not an image digest: {digest!r}")
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.isdir(self._dir(digest))
+
+    def put(self, image_data: ImageSource, model_size: Tuple[int, int], digest: Optional[str] = None) -> str:
+        """
+        Store an image, returning its digest. Only the original is written before this
+        returns; the variants follow in the background. `model_size` is the detector's
+        (height, width). Storing an image that is already there is a no-op.
+        """
+        if digest is None:
+            digest = ResultCache.hash_image(image_data)
+        target = self._dir(digest)
+        if os.path.isdir(target):
+            # Counts as fresh again for collect_garbage(), until the new reference is written
+            try:
+                os.utime(target)
+            except FileNotFoundError:
+                pass
+            else:
+                with self._lock:
+                    self.deduplicated += 1
+                self._schedule_variants(digest, model_size)
+                return digest
+
+        # Build the directory privately, then move it into place in one rename
+        staging = f"{target}.{threading.get_ident()}.tmp"
+        os.makedirs(staging, exist_ok=True)
+        try:
+            upload = os.path.join(staging, "upload")
+            if isinstance(image_data, (bytes, bytearray, memoryview)):
+                with open(upload, "wb") as f:
+                    f.write(image_data)
+            else:
+                image_data.seek(0)
+                with open(upload, "wb") as f:
+                    shutil.copyfileobj(image_data, f, 1024 * 1024)
+            # Opening only reads the header: enough to reject non-images and name the original
+            with Image.open(upload) as image:
+                name, _ = _ORIGINAL_FORMATS.get(image.format, _DEFAULT_ORIGINAL)
+            os.replace(upload, os.path.join(staging, name))
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                os.rename(staging, target)
+            except OSError:
+                # Another request stored the same image first
+                if not os.path.isdir(target):
+                    raise
+                shutil.rmtree(staging, ignore_errors=True)
+                with self._lock:
+                    self.deduplicated += 1
+                return digest
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            with self._lock:
+                self.failed += 1
+            raise
+        with self._lock:
+            self.stored += 1
+        self._schedule_variants(digest, model_size)
+        return digest
+
+    def _missing_variants(self, digest: str) -> bool:
+        directory = self._dir(digest)
+        return any(not os.path.exists(os.path.join(directory, name)) for name, _ in VARIANTS.values())
+
+    def _schedule_variants(self, digest: str, model_size: Tuple[int, int]):
+        if not self._missing_variants(digest):
+            return
+        with self._lock:
+            if digest in self._pending:
+                return
+            self._pending.add(digest)
+        self._executor.submit(self._build_in_background, digest, model_size)
+
+    def _build_in_background(self, digest: str, model_size: Tuple[int, int]):
+        try:
+            self.build_variants(digest, model_size)
+        except FileNotFoundError:
+            pass  # collected before its variants were built
+        except Exception as e:
+            logger.warning(f"Could not build the variants of image {digest}: {str(e)}")
+            with self._lock:
+                self.failed += 1
+        finally:
+            with self._lock:
+                self._pending.discard(digest)
+
+    def build_variants(self, digest: str, model_size: Tuple[int, int]):
+        """Write the thumbnail and model-size variants of a stored image, if they are missing."""
+        directory = self._dir(digest)
+        if not self._missing_variants(digest):
+            return
+        original, _ = self.path(digest)
+        with Image.open(original) as image:
+            height, width = model_size
+            # Decode JPEGs at the smallest scale that still covers both variants
+            image.draft("RGB", (max(width, self.thumbnail_size), max(height, self.thumbnail_size)))
+            rgb = image.convert("RGB") if image.mode != "RGB" else image
+            # Written under a temporary name and renamed, so readers never see a partial file
+            name = VARIANTS["model"][0]
+            tmp_path = os.path.join(directory, f"{name}.{threading.get_ident()}.tmp")
+            rgb.resize((width, height), reducing_gap=3.0).save(tmp_path, format="PNG")
+            os.replace(tmp_path, os.path.join(directory, name))
+            name = VARIANTS["thumbnail"][0]
+            tmp_path = os.path.join(directory, f"{name}.{threading.get_ident()}.tmp")
+            rgb.thumbnail((self.thumbnail_size, self.thumbnail_size))
+            rgb.save(tmp_path, format="JPEG", quality=85)
+            os.replace(tmp_path, os.path.join(directory, name))
+
+    def path(self, digest: str, variant: str = "original", model_size: Optional[Tuple[int, int]] = None) -> Tuple[str, str]:
+        """
+        (file path, media type) of a stored variant. Raises FileNotFoundError if it isn't
+        stored. With `model_size`, variants not built yet are built on the spot.
+        """
+        directory = self._dir(digest)
+        if variant == "original":
+            for name, media_type in list(_ORIGINAL_FORMATS.values()) + [_DEFAULT_ORIGINAL]:
+                path = os.path.join(directory, name)
+                if os.path.exists(path):
+                    return path, media_type
+            raise FileNotFoundError(digest)
+        if variant not in VARIANTS:
+            raise ValueError(f"Unknown variant '{variant}'. Choose one of: original, {', '.join(VARIANTS)}")
+        name, media_type = VARIANTS[variant]
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            if model_size is None:
+                raise FileNotFoundError(digest)
+            # Still queued for the background thread, or its build failed
+            self.build_variants(digest, model_size)
+        return path, media_type
+
+    def _stored(self) -> Iterable[Tuple[str, str]]:
+        """(digest, directory) of every stored image."""
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                if self.is_digest(name):
+                    yield name, os.path.join(prefix_dir, name)
+
+    @staticmethod
+    def _size(directory: str) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def collect_garbage(self, reference_counts: Dict[str, int], min_age_seconds: float = 3600.0) -> Dict[str, Any]:
+        """
+        Delete every image with no references in `reference_counts` (digest -> number of
+        chat history rows). Images younger than min_age_seconds are kept, since the row
+        that refers to a freshly stored image may not have been written yet.
+        """
+        cutoff = time.time() - min_age_seconds
+        scanned = removed = freed = 0
+        for digest, directory in list(self._stored()):
+            scanned += 1
+            if reference_counts.get(digest, 0) > 0:
+                continue
+            try:
+                if os.stat(directory).st_mtime > cutoff:
+                    continue
+                size = self._size(directory)
+                shutil.rmtree(directory)
+            except FileNotFoundError:
+                continue
+            try:
+                os.rmdir(os.path.dirname(directory))
+            except OSError:
+                pass  # other images still share the prefix directory
+            removed += 1
+            freed += size
+        if removed:
+            logger.info(f"Image store garbage collection removed {removed} images ({freed} bytes)")
+        return {"scanned": scanned, "removed": removed, "freed_bytes": freed}
+
+    def close(self):
+        """Finish building the queued variants."""
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> Dict[str, Any]:
+        images = total_bytes = 0
+        for _, directory in self._stored():
+            images += 1
+            total_bytes += self._size(directory)
+        with self._lock:
+            return {
+                "root": self.root,
+                "images": images,
+                "bytes": total_bytes,
+                "stored": self.stored,
+                "deduplicated": self.deduplicated,
+                "variants_pending": len(self._pending),
+                "failed": self.failed,
+            }
+
+
+# Initialize image store
+image_store: Optional[ImageStore] = None
+
+def initialize_image_store(root: str, thumbnail_size: int = 256) -> ImageStore:
+    """Create the image store under `root`."""
+    global image_store
+    if image_store is not None:
+        image_store.close()
+    image_store = ImageStore(root, thumbnail_size=thumbnail_size)
+    logger.info(f"Image store enabled (root={root}, thumbnail_size={thumbnail_size})")
+    return image_store
+
+def close_image_store():
+    """Build the variants still queued and release the store."""
+    global image_store
+    if image_store is not None:
+        image_store.close()
+        image_store = None
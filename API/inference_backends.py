@@ -0,0 +1,213 @@
+import os
+import threading
+import logging
+from typing import Dict, Optional, Tuple, Type
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Default artifact name for each backend, relative to the API folder
+MODEL_FILES = {
+    "keras": "my_model.h5",
+    "tflite": "my_model.tflite",
+    "onnx": "my_model.onnx",
+}
+
+# Model used when the .h5 file cannot be loaded directly
+HUB_URL = "https://www.kaggle.com/models/google/mobilenet-v2/TensorFlow2/035-128-classification/2"
+
+
+class InferenceBackend:
+    """
+    Common interface for the runtimes ImageDetector can run on.
+    predict() takes a float32 (N, H, W, 3) batch and returns an (N, num_classes) array.
+    """
+
+    name = "base"
+
+    def __init__(self, model_path: str):
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"Model file not found at {model_path}")
+        self.model_path = model_path
+        self.input_shape: Tuple[Optional[int], ...] = (None, 224, 224, 3)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+    def prepare(self, batch_sizes: Tuple[int, ...]):
+        """Build whatever the runtime needs to serve these exact batch sizes without retracing."""
+
+    def close(self):
+        """Release the resources held by the runtime."""
+
+
+def load_keras_model(model_path: str):
+    """Load the Keras model, rebuilding it around the TF-Hub layer if direct loading fails."""
+    import tensorflow as tf
+    import tensorflow_hub as hub
+
+    keras = tf.keras
+
+    logger.info("Loading model...")
+    try:
+        # First try loading directly with proper signatures
+        model = keras.models.load_model(model_path, custom_objects={
+            'KerasLayer': hub.KerasLayer,
+            'keras_layer': hub.KerasLayer
+        })
+        logger.info("Model loaded successfully with direct loading")
+    except Exception as load_error:
+        logger.warning(f"Direct loading failed, trying alternative approach: {str(load_error)}")
+        # If that fails, try recreating the model with compatible layer
+        inputs = keras.layers.Input(shape=(224, 224, 3))
+        hub_layer = hub.KerasLayer(HUB_URL, trainable=False, output_shape=[1280])
+        features = hub_layer(inputs)
+        outputs = keras.layers.Dense(1000, activation='softmax')(features)
+
+        model = keras.Model(inputs, outputs)
+
+        # Try to load weights
+        try:
+            model.load_weights(model_path)
+            logger.info("Weights loaded successfully")
+        except Exception as weight_error:
+            logger.warning(f"Weight loading failed: {str(weight_error)}")
+            # Initialize from scratch if weight loading fails
+            model.compile(
+                optimizer='adam',
+                loss='sparse_categorical_crossentropy',
+                metrics=['accuracy']
+            )
+        logger.info("Model created successfully with alternative approach")
+
+    # Log the model summary (one line per layer, so only at DEBUG)
+    model.summary(print_fn=logger.debug)
+    return model
+
+
+class KerasBackend(InferenceBackend):
+    """Runs the original .h5 model through keras.Model.predict."""
+
+    name = "keras"
+
+    def __init__(self, model_path: str):
+        super().__init__(model_path)
+        self.model = load_keras_model(model_path)
+        if self.model.input_shape is not None:
+            self.input_shape = tuple(self.model.input_shape)
+        # Concrete tf.functions with a fixed input signature, one per batch size
+        self._functions = {}
+
+    def prepare(self, batch_sizes: Tuple[int, ...]):
+        """Trace the model once per batch size so predict() skips keras.Model.predict's per-call setup."""
+        import tensorflow as tf
+
+        serve = tf.function(lambda images: self.model(images, training=False))
+        for batch_size in batch_sizes:
+            spec = tf.TensorSpec((batch_size,) + tuple(self.input_shape[1:]), tf.float32)
+            self._functions[batch_size] = serve.get_concrete_function(spec)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        function = self._functions.get(batch.shape[0])
+        if function is None:
+            return np.asarray(self.model.predict(batch, verbose=0))
+        return np.asarray(function(batch))
+
+
+class TFLiteBackend(InferenceBackend):
+    """Runs a converted .tflite model with the TFLite interpreter."""
+
+    name = "tflite"
+
+    def __init__(self, model_path: str):
+        super().__init__(model_path)
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tensorflow.lite import Interpreter
+            except ImportError:
+                raise ImportError("The tflite backend requires tflite-runtime or tensorflow to be installed")
+
+        self._interpreter_class = Interpreter
+        self.interpreter = self._create_interpreter()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self.input_shape = (None,) + tuple(int(d) for d in self._input["shape"][1:])
+        self._batch_size = int(self._input["shape"][0])
+        # Interpreters already allocated for a fixed batch size (see prepare)
+        self._interpreters = {}
+        # The interpreter holds per-invocation state, so calls must not overlap
+        self._lock = threading.Lock()
+
+    def _create_interpreter(self, batch_size: Optional[int] = None):
+        interpreter = self._interpreter_class(model_path=self.model_path, num_threads=os.cpu_count())
+        if batch_size is not None:
+            index = interpreter.get_input_details()[0]["index"]
+            interpreter.resize_tensor_input(index, [batch_size] + list(self.input_shape[1:]))
+        interpreter.allocate_tensors()
+        return interpreter
+
+    def prepare(self, batch_sizes: Tuple[int, ...]):
+        """Allocate one interpreter per batch size so batches never trigger a tensor reallocation."""
+        for batch_size in batch_sizes:
+            self._interpreters[batch_size] = self._create_interpreter(batch_size)
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        with self._lock:
+            interpreter = self._interpreters.get(batch.shape[0])
+            if interpreter is None:
+                interpreter = self.interpreter
+                if batch.shape[0] != self._batch_size:
+                    interpreter.resize_tensor_input(self._input["index"], list(batch.shape))
+                    interpreter.allocate_tensors()
+                    self._batch_size = batch.shape[0]
+            interpreter.set_tensor(self._input["index"], batch.astype(self._input["dtype"], copy=False))
+            interpreter.invoke()
+            return np.array(interpreter.get_tensor(self._output["index"]))
+
+    def close(self):
+        self.interpreter = None
+        self._interpreters = {}
+
+
+class ONNXBackend(InferenceBackend):
+    """Runs a converted .onnx model with ONNX Runtime on CPU."""
+
+    name = "onnx"
+
+    def __init__(self, model_path: str):
+        super().__init__(model_path)
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime to be installed")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        self.input_shape = (None,) + tuple(d if isinstance(d, int) else None for d in model_input.shape[1:])
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self._input_name: batch})[0]
+
+    def close(self):
+        self.session = None
+
+
+BACKENDS: Dict[str, Type[InferenceBackend]] = {
+    "keras": KerasBackend,
+    "tflite": TFLiteBackend,
+    "onnx": ONNXBackend,
+}
+
+
+def load_backend(name: str, model_path: str) -> InferenceBackend:
+    """Create the backend registered under `name` for the given model file."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+    logger.info(f"Loading {name} backend from {model_path}")
+    return BACKENDS[name](model_path)
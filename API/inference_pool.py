@@ -0,0 +1,286 @@
+import signal
+import threading
+import time
+import logging
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from detection_utils import BatchOutput, ImageDetector, ImageSource, run_batch
+
+logger = logging.getLogger(__name__)
+
+# Workers are spawned, not forked, so no TensorFlow state is shared with the API process
+_context = mp.get_context("spawn")
+# Seconds before a worker that failed to restart is tried again
+RESTART_BACKOFF_SECONDS = 10.0
+
+
+def _worker_main(conn, model_path: str, backend: str, max_batch_size: int, warmup: bool, version: Optional[str]):
+    """
+    Entry point of a worker process.
+
+    Loads its own ImageDetector, reports the tensor shapes it needs, then attaches to
+    the shared-memory blocks the parent created and serves forward passes: the parent
+    writes a batch into the input block and sends its size, the worker writes the
+    model output into the output block and replies.
+    """
+    # Shutdown is driven by the parent, not by the terminal's Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    try:
+        detector = ImageDetector(model_path, backend=backend, max_batch_size=max_batch_size, version=version)
+        if warmup:
+            detector.warmup()
+        height, width = detector.image_size
+        probe = detector.backend.predict(np.zeros((1, height, width, 3), dtype=np.float32))
+        conn.send(("ready", {
+            "image_size": detector.image_size,
+            "output_shape": tuple(probe.shape[1:]),
+            "batch_sizes": detector.batch_sizes,
+            "model_version": detector.model_version,
+            "warmup_seconds": detector.warmup_seconds,
+        }))
+    except Exception as e:
+        conn.send(("error", str(e)))
+        return
+
+    names = conn.recv()
+    if names is None:
+        detector.close()
+        return
+    input_name, output_name = names
+    input_block = shared_memory.SharedMemory(name=input_name)
+    output_block = shared_memory.SharedMemory(name=output_name)
+    max_rows = detector.batch_sizes[-1]
+    inputs = np.ndarray((max_rows, height, width, 3), dtype=np.float32, buffer=input_block.buf)
+    outputs = np.ndarray((max_rows,) + tuple(probe.shape[1:]), dtype=np.float32, buffer=output_block.buf)
+
+    try:
+        while True:
+            batch_size = conn.recv()
+            if batch_size is None:
+                break
+            try:
+                outputs[:batch_size] = detector.backend.predict(inputs[:batch_size])
+                conn.send(("ok", None))
+            except Exception as e:
+                conn.send(("error", str(e)))
+    finally:
+        del inputs, outputs
+        input_block.close()
+        output_block.close()
+        detector.close()
+
+
+class _Worker:
+    """Parent-side handle for one worker process and its shared-memory blocks."""
+
+    def __init__(self, index: int, model_path: str, backend: str, max_batch_size: int, warmup: bool, version: Optional[str]):
+        self.index = index
+        self.conn, child_conn = _context.Pipe()
+        self.process = _context.Process(
+            target=_worker_main,
+            args=(child_conn, model_path, backend, max_batch_size, warmup, version),
+            name=f"inference-worker-{index}",
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+        # Only one batch at a time can use this worker's shared-memory blocks
+        self.lock = threading.Lock()
+        # Images assigned to this worker that have not finished yet
+        self.load = 0
+        self.batches = 0
+        self.input_block: Optional[shared_memory.SharedMemory] = None
+        self.output_block: Optional[shared_memory.SharedMemory] = None
+
+    def wait_ready(self) -> Dict[str, Any]:
+        """Wait for the model to load, then create and hand over the shared-memory blocks."""
+        try:
+            status, info = self.conn.recv()
+        except EOFError:
+            status, info = "error", f"process exited with code {self.process.exitcode}"
+        if status != "ready":
+            self.process.join()
+            raise Exception(f"Inference worker {self.index} failed to start: {info}")
+
+        height, width = info["image_size"]
+        max_rows = info["batch_sizes"][-1]
+        input_shape = (max_rows, height, width, 3)
+        output_shape = (max_rows,) + tuple(info["output_shape"])
+        self.input_block = shared_memory.SharedMemory(create=True, size=int(np.prod(input_shape)) * 4)
+        self.output_block = shared_memory.SharedMemory(create=True, size=int(np.prod(output_shape)) * 4)
+        self.inputs = np.ndarray(input_shape, dtype=np.float32, buffer=self.input_block.buf)
+        self.outputs = np.ndarray(output_shape, dtype=np.float32, buffer=self.output_block.buf)
+        self.conn.send((self.input_block.name, self.output_block.name))
+        return info
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        """Run a batch that was already written into self.inputs. Caller holds self.lock."""
+        try:
+            self.conn.send(batch.shape[0])
+            status, error = self.conn.recv()
+        except (EOFError, OSError):
+            raise Exception(f"Inference worker {self.index} is not running")
+        if status != "ok":
+            raise Exception(error)
+        self.batches += 1
+        return self.outputs[:batch.shape[0]]
+
+    def close(self, timeout: float = 5.0):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        for block in (self.input_block, self.output_block):
+            if block is not None:
+                block.close()
+                block.unlink()
+        self.input_block = self.output_block = None
+
+
+class InferencePool:
+    """
+    Runs the model in several worker processes, each holding its own ImageDetector.
+
+    Images are decoded and normalized in the API process directly into a worker's
+    shared-memory input block, so tensors never get pickled; only the batch size
+    crosses the pipe. Each batch goes to the live worker with the fewest images in
+    flight; a worker whose process has died is skipped and restarted in the background.
+    Exposes the same predict_batch / describe / close interface as ImageDetector.
+    """
+
+    def __init__(self, model_path: str, backend: str = "keras", workers: int = 2, max_batch_size: int = 8, warmup: bool = True, version: Optional[str] = None):
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.backend_name = backend
+        self._worker_args = (model_path, backend, max_batch_size, warmup, version)
+        self._lock = threading.Lock()
+        self._workers: List[_Worker] = []
+        # Indexes of dead workers being restarted, and when a failed restart may be retried
+        self._restarting = set()
+        self._retry_at: Dict[int, float] = {}
+        self._closed = False
+        self.restarts = 0
+        try:
+            # Start every process first so the models load in parallel
+            for i in range(workers):
+                self._workers.append(_Worker(i, model_path, backend, max_batch_size, warmup, version))
+            infos = [worker.wait_ready() for worker in self._workers]
+        except Exception:
+            self.close()
+            raise
+
+        info = infos[0]
+        self.image_size: Tuple[int, int] = tuple(info["image_size"])
+        self.batch_sizes: Tuple[int, ...] = tuple(info["batch_sizes"])
+        self.model_version: str = info["model_version"]
+        warmups = [i["warmup_seconds"] for i in infos if i["warmup_seconds"] is not None]
+        self.warmup_seconds: Optional[float] = max(warmups) if warmups else None
+        logger.info(f"Inference pool ready with {workers} workers ({self.model_version})")
+
+    def _live_workers(self) -> List[_Worker]:
+        """Workers whose process is running. Starts a restart for each dead one. Caller holds self._lock."""
+        live = []
+        for worker in self._workers:
+            if worker.process.is_alive():
+                live.append(worker)
+            elif not self._closed and worker.index not in self._restarting and time.monotonic() >= self._retry_at.get(worker.index, 0.0):
+                self._restarting.add(worker.index)
+                logger.warning(f"Inference worker {worker.index} exited with code {worker.process.exitcode}; restarting it")
+                threading.Thread(target=self._restart, args=(worker,), name=f"inference-restart-{worker.index}", daemon=True).start()
+        return live
+
+    def _restart(self, old: _Worker):
+        """Start a replacement for a dead worker and swap it in once its model is loaded."""
+        new = None
+        try:
+            new = _Worker(old.index, *self._worker_args)
+            new.wait_ready()
+        except Exception as e:
+            logger.error(f"Could not restart inference worker {old.index}: {str(e)}")
+            if new is not None:
+                new.close()
+            with self._lock:
+                self._restarting.discard(old.index)
+                self._retry_at[old.index] = time.monotonic() + RESTART_BACKOFF_SECONDS
+            return
+        with self._lock:
+            replaced = not self._closed
+            if replaced:
+                self._workers[self._workers.index(old)] = new
+                self.restarts += 1
+            self._restarting.discard(old.index)
+        if not replaced:
+            new.close()
+            return
+        logger.info(f"Inference worker {old.index} restarted (pid {new.process.pid})")
+        # Batches that were sent to the dead worker have failed by now; wait for them to let go
+        with old.lock:
+            old.close()
+
+    def lost_workers(self) -> int:
+        """Number of workers not running at the moment (being restarted or waiting to be)."""
+        with self._lock:
+            return len(self._workers) - len(self._live_workers())
+
+    def _acquire_worker(self, images: int) -> _Worker:
+        with self._lock:
+            live = self._live_workers()
+            if not live:
+                raise Exception("No inference worker is running")
+            worker = min(live, key=lambda w: w.load)
+            worker.load += images
+        return worker
+
+    def predict_batch(self, images: List[ImageSource]) -> List[Union[BatchOutput, Exception]]:
+        """Run a batch on the least loaded worker. Same contract as ImageDetector.predict_batch."""
+        if len(images) > self.batch_sizes[-1]:
+            raise ValueError(f"Batch of {len(images)} images exceeds the pool's maximum of {self.batch_sizes[-1]}")
+        worker = self._acquire_worker(len(images))
+        try:
+            with worker.lock:
+                return run_batch(images, self.image_size, self.batch_sizes, worker.inputs, worker.forward)
+        finally:
+            with self._lock:
+                worker.load -= len(images)
+
+    def predict(self, image_data: ImageSource) -> Tuple[List[Dict[str, Any]], List[float], float]:
+        """Perform detection on a single image."""
+        output = self.predict_batch([image_data])[0]
+        if isinstance(output, Exception):
+            raise output
+        return output[:3]
+
+    def describe(self) -> Dict[str, Any]:
+        """Summary of the pool for status endpoints."""
+        with self._lock:
+            workers = [
+                {"pid": w.process.pid, "alive": w.process.is_alive(), "in_flight": w.load, "batches": w.batches}
+                for w in self._workers
+            ]
+            restarts = self.restarts
+        return {
+            "model_version": self.model_version,
+            "backend": self.backend_name,
+            "batch_sizes": list(self.batch_sizes),
+            "warmup_seconds": self.warmup_seconds,
+            "workers": workers,
+            "restarts": restarts,
+        }
+
+    def close(self):
+        """Stop every worker process and release the shared memory."""
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            worker.close()
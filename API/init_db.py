@@ -1,4 +1,5 @@
 from database import engine, get_db, database_exists
+from migrations import run_migrations
 import models
 import security
 from sqlalchemy.orm import Session
@@ -38,6 +39,7 @@ def init_db():
         # Check if database already exists and has tables
         if database_exists():
             logger.info("Database already exists with tables, skipping initialization")
+            run_migrations(engine)
             # Just verify admin user exists
             db = next(get_db())
             create_admin_user(db)
@@ -47,6 +49,7 @@ def init_db():
         logger.info("Initializing new database...")
         # Create all tables
         models.Base.metadata.create_all(bind=engine)
+        run_migrations(engine)
         logger.info("Created all tables successfully")
         
         # Create admin user
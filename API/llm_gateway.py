@@ -0,0 +1,327 @@
+import asyncio
+import hashlib
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional, Type
+
+logger = logging.getLogger(__name__)
+
+
+class LLMError(Exception):
+    """The LLM call failed."""
+
+
+class LLMUnavailableError(LLMError):
+    """No provider is configured."""
+
+
+class LLMTimeoutError(LLMError):
+    """The call (including time spent queued) ran past its deadline."""
+
+
+class LLMQueueFullError(LLMError):
+    """Too many calls are already waiting for a free slot."""
+
+
+class LLMProvider:
+    """A text-generation backend the gateway can call. generate() must not block the event loop."""
+
+    name = "base"
+
+    async def generate(self, prompt: str, timeout: float) -> str:
+        raise NotImplementedError
+
+    async def stream(self, prompt: str, timeout: float) -> AsyncIterator[str]:
+        """Yield the answer in pieces as they are generated. Defaults to a single piece."""
+        yield await self.generate(prompt, timeout)
+
+    def describe(self) -> Dict[str, Any]:
+        return {"provider": self.name}
+
+    def config_key(self) -> str:
+        """Settings that shape an answer; calls are only coalesced when these match."""
+        return json.dumps(self.describe(), sort_keys=True, default=str)
+
+    async def close(self):
+        """Release connections held by the provider."""
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Google Gemini through the SDK's async client. One GenerativeModel is kept for the
+    life of the provider, so every call reuses the same underlying channel.
+    """
+
+    name = "gemini"
+
+    def __init__(self, api_key: str, model_name: str, generation_config: Dict[str, Any], safety_settings: List[Dict[str, str]]):
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self.generation_config = generation_config
+        self.model = genai.GenerativeModel(
+            model_name=model_name,
+            generation_config=generation_config,
+            safety_settings=safety_settings
+        )
+
+    async def generate(self, prompt: str, timeout: float) -> str:
+        response = await self.model.generate_content_async(prompt, request_options={"timeout": timeout})
+        return response.text
+
+    async def stream(self, prompt: str, timeout: float) -> AsyncIterator[str]:
+        response = await self.model.generate_content_async(prompt, stream=True, request_options={"timeout": timeout})
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    def describe(self) -> Dict[str, Any]:
+        return {"provider": self.name, "model": self.model_name}
+
+    def config_key(self) -> str:
+        return json.dumps([self.describe(), self.generation_config], sort_keys=True, default=str)
+
+
+class LocalProvider(LLMProvider):
+    """
+    Offline stand-in that answers after a fixed delay with text derived from the prompt.
+    Lets the service run, and be load-tested, without a key or network access.
+    """
+
+    name = "local"
+
+    def __init__(self, latency_ms: float = 200.0):
+        self.latency = latency_ms / 1000.0
+
+    @staticmethod
+    def _answer(prompt: str) -> str:
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:8]
+        return f"[local {digest}] Generated offline for: {prompt}"
+
+    async def generate(self, prompt: str, timeout: float) -> str:
+        await asyncio.sleep(self.latency)
+        return self._answer(prompt)
+
+    async def stream(self, prompt: str, timeout: float) -> AsyncIterator[str]:
+        # Spread the latency over the words, the way a real model emits tokens
+        words = self._answer(prompt).split(" ")
+        for i, word in enumerate(words):
+            await asyncio.sleep(self.latency / len(words))
+            yield word if i == 0 else " " + word
+
+    def describe(self) -> Dict[str, Any]:
+        return {"provider": self.name, "latency_ms": self.latency * 1000.0}
+
+
+PROVIDERS: Dict[str, Type[LLMProvider]] = {
+    "gemini": GeminiProvider,
+    "local": LocalProvider,
+}
+
+
+class LLMGateway:
+    """
+    Single path for every LLM call in the API.
+
+    At most `max_concurrency` calls run at once; the rest wait their turn in arrival
+    order (asyncio.Semaphore wakes waiters first in, first out), and no more than
+    `max_queue` may wait. Each call has a deadline that covers both the wait and the
+    call itself.
+
+    With `coalesce` on, generate() calls for the same prompt that overlap in time share
+    one upstream call (single flight): the first starts it, the others wait for its
+    result, each within its own deadline.
+    """
+
+    def __init__(
+        self,
+        provider: LLMProvider,
+        max_concurrency: int = 8,
+        timeout: float = 30.0,
+        max_queue: int = 256,
+        coalesce: bool = True
+    ):
+        self.provider = provider
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_queue = max_queue
+        self.coalesce = coalesce
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight_calls: Dict[str, "asyncio.Task[str]"] = {}
+        self.coalesced = 0
+        self.in_flight = 0
+        self.queued = 0
+        self.calls = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self._latency_total = 0.0
+        self._queue_wait_total = 0.0
+
+    async def _acquire(self, deadline: float) -> float:
+        """Wait for a free slot until `deadline`. Returns the time the slot was granted."""
+        loop = asyncio.get_running_loop()
+        if self._semaphore.locked() and self.queued >= self.max_queue:
+            self.rejected += 1
+            raise LLMQueueFullError(f"{self.queued} LLM calls are already waiting. Please retry shortly.")
+
+        queued_at = loop.time()
+        self.queued += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), max(deadline - queued_at, 0.0))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMTimeoutError("Timed out waiting for a free LLM slot")
+        finally:
+            self.queued -= 1
+
+        started_at = loop.time()
+        self._queue_wait_total += started_at - queued_at
+        self.in_flight += 1
+        return started_at
+
+    def _release(self, started_at: float):
+        self.in_flight -= 1
+        self.calls += 1
+        self._latency_total += asyncio.get_running_loop().time() - started_at
+        self._semaphore.release()
+
+    async def generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        """Generate text for `prompt`, raising an LLMError subclass on failure."""
+        if not self.coalesce:
+            return await self._generate(prompt, timeout)
+
+        budget = timeout if timeout is not None else self.timeout
+        key = hashlib.sha256(json.dumps([prompt, self.provider.config_key()]).encode()).hexdigest()
+        call = self._in_flight_calls.get(key)
+        joined = call is not None
+        if joined:
+            self.coalesced += 1
+        else:
+            # Run the upstream call as its own task, so a caller that disconnects doesn't cancel it for the others
+            call = asyncio.ensure_future(self._generate(prompt, budget))
+            self._in_flight_calls[key] = call
+            call.add_done_callback(lambda done: self._call_finished(key, done))
+        try:
+            return await asyncio.wait_for(asyncio.shield(call), budget)
+        except asyncio.TimeoutError:
+            # The upstream call counts its own timeout; only count callers that gave up on someone else's
+            if joined:
+                self.timeouts += 1
+            raise LLMTimeoutError(f"The LLM did not answer within {budget:g} seconds")
+
+    def _call_finished(self, key: str, call: "asyncio.Task[str]"):
+        if self._in_flight_calls.get(key) is call:
+            del self._in_flight_calls[key]
+        # Mark the error as retrieved; the waiters (if any are left) have been handed it already
+        if not call.cancelled():
+            call.exception()
+
+    async def _generate(self, prompt: str, timeout: Optional[float] = None) -> str:
+        budget = timeout if timeout is not None else self.timeout
+        deadline = asyncio.get_running_loop().time() + budget
+        started_at = await self._acquire(deadline)
+        try:
+            remaining = max(deadline - started_at, 0.0)
+            return await asyncio.wait_for(self.provider.generate(prompt, remaining), remaining)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMTimeoutError(f"The LLM did not answer within {budget:g} seconds")
+        except LLMError:
+            self.failures += 1
+            raise
+        except Exception as e:
+            self.failures += 1
+            raise LLMError(str(e)) from e
+        finally:
+            self._release(started_at)
+
+    async def stream(self, prompt: str, timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Yield the answer for `prompt` piece by piece. The slot is held until the stream
+        ends or the consumer stops iterating, and the deadline covers the whole answer.
+        """
+        loop = asyncio.get_running_loop()
+        budget = timeout if timeout is not None else self.timeout
+        deadline = loop.time() + budget
+        started_at = await self._acquire(deadline)
+        chunks = self.provider.stream(prompt, max(deadline - started_at, 0.0))
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(deadline - loop.time(), 0.0))
+                except StopAsyncIteration:
+                    break
+                yield chunk
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise LLMTimeoutError(f"The LLM did not finish within {budget:g} seconds")
+        except LLMError:
+            self.failures += 1
+            raise
+        except Exception as e:
+            self.failures += 1
+            raise LLMError(str(e)) from e
+        finally:
+            await chunks.aclose()
+            self._release(started_at)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.provider.describe(),
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "timeout_seconds": self.timeout,
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "calls": self.calls,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "coalesce": self.coalesce,
+            "coalesced": self.coalesced,
+            "average_latency_ms": self._latency_total / self.calls * 1000.0 if self.calls else 0.0,
+            "average_queue_wait_ms": self._queue_wait_total / self.calls * 1000.0 if self.calls else 0.0,
+        }
+
+    async def close(self):
+        await self.provider.close()
+
+
+# Initialize LLM gateway
+gateway: Optional[LLMGateway] = None
+
+def create_provider(name: str, **kwargs) -> LLMProvider:
+    """Create the provider registered under `name`."""
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider '{name}'. Choose one of: {', '.join(PROVIDERS)}")
+    return PROVIDERS[name](**kwargs)
+
+def initialize_gateway(
+    provider: LLMProvider,
+    max_concurrency: int = 8,
+    timeout: float = 30.0,
+    max_queue: int = 256,
+    coalesce: bool = True
+) -> LLMGateway:
+    """Create the LLM gateway around an already configured provider."""
+    global gateway
+    gateway = LLMGateway(provider, max_concurrency=max_concurrency, timeout=timeout, max_queue=max_queue, coalesce=coalesce)
+    logger.info(
+        f"LLM gateway ready ({provider.name}, max_concurrency={max_concurrency}, timeout={timeout}s, "
+        f"max_queue={max_queue}, coalesce={coalesce})"
+    )
+    return gateway
+
+def get_gateway() -> LLMGateway:
+    """Get the LLM gateway, or raise LLMUnavailableError when no provider is configured."""
+    if gateway is None:
+        raise LLMUnavailableError("No LLM is configured. Set GEMINI_API_KEY or LLM_PROVIDER=local.")
+    return gateway
+
+async def close_gateway():
+    global gateway
+    if gateway is not None:
+        await gateway.close()
+        gateway = None
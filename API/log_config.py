@@ -0,0 +1,132 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+# Attributes every LogRecord has; anything else was passed through `extra` and is emitted as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Logger for the one-line-per-request summaries written when request logging is switched on
+request_logger = logging.getLogger("api.requests")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_settings_lock = threading.Lock()
+request_log_enabled = False
+request_log_sample_rate = 1.0
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller and leaves the formatting to the listener."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only resolve what can't safely cross threads: message arguments and the traceback
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+def configure_logging(level: str = "INFO", fmt: str = "json", queue_size: int = 10000):
+    """
+    Route every log record through a bounded queue to a background thread that writes stdout.
+
+    Request threads and the event loop only pay for a put_nowait; formatting and the
+    write itself happen on the listener thread. When the queue is full, records are dropped
+    instead of blocking the caller.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT))
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=queue_size)
+    handler = _DroppingQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level.upper())
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging():
+    """Write out everything still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
+
+
+def set_level(level: str):
+    """Change the root log level at runtime (DEBUG turns on per-image detection logs)."""
+    logging.getLogger().setLevel(level.upper())
+
+
+def set_request_logging(enabled: bool, sample_rate: Optional[float] = None):
+    """Switch the per-request summary lines on or off, optionally changing the fraction sampled."""
+    global request_log_enabled, request_log_sample_rate
+    with _settings_lock:
+        request_log_enabled = enabled
+        if sample_rate is not None:
+            request_log_sample_rate = min(max(sample_rate, 0.0), 1.0)
+
+
+def sample_request() -> bool:
+    """Whether the current request should get a summary line."""
+    return request_log_enabled and (request_log_sample_rate >= 1.0 or random.random() < request_log_sample_rate)
+
+
+def logging_settings() -> Dict[str, Any]:
+    return {
+        "level": logging.getLevelName(logging.getLogger().level),
+        "request_log": request_log_enabled,
+        "request_log_sample_rate": request_log_sample_rate,
+        "dropped_records": _DroppingQueueHandler.dropped,
+    }
@@ -1,59 +1,115 @@
-from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Query
+from fastapi import FastAPI, HTTPException, Depends, status, File, UploadFile, Query, Request, Response
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, FileResponse
+from sqlalchemy import func, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from datetime import timedelta
-import google.generativeai as genai
+import asyncio
+import hashlib
+import json
+import threading
+import time
+import logging
+import zipfile
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 import os
-from typing import List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Callable, Awaitable
+
+# Load environment variables, before the modules below read their settings on import
+load_dotenv()
 
 import models
 import schemas
 import security
-from database import engine, get_db
-from detection_utils import initialize_detector, get_detector
+import pagination
+from database import engine, async_engine, get_async_db, SessionLocal
+from migrations import run_migrations
+from model_registry import ModelRegistry
+from advice import AdviceCache, advice_prompt, config_fingerprint
+from semantic_cache import SemanticCache
+from history_writer import initialize_history_writer, record_history, stop_history_writer
+from history_counts import add_history_counts, rebuild_history_counts
+import history_writer
+from image_store import initialize_image_store, close_image_store
+import image_store
+import llm_gateway
+from llm_gateway import (
+    LLMError, LLMQueueFullError, LLMTimeoutError, LLMUnavailableError,
+    create_provider, initialize_gateway, get_gateway, close_gateway
+)
+from inference_backends import MODEL_FILES
+from timing import Timings, detection_stages, render_metrics
+import log_config
+from log_config import configure_logging, request_logger, sample_request
+from detection_utils import (
+    initialize_detector, get_detector, initialize_batcher, get_batcher,
+    initialize_result_cache, submit_detection, create_detector, swap_detector, retire_detector,
+    Detection, QueueFullError
+)
+import detection_utils
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+# Logging: LOG_LEVEL=DEBUG adds per-image detection logs, LOG_FORMAT=text for plain lines.
+# REQUEST_LOG writes one summary line per request for a REQUEST_LOG_SAMPLE_RATE fraction of them;
+# all three can be changed at runtime through /admin/logging.
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+configure_logging(LOG_LEVEL, LOG_FORMAT)
+log_config.set_request_logging(
+    os.getenv("REQUEST_LOG", "0") != "0",
+    float(os.getenv("REQUEST_LOG_SAMPLE_RATE", "0.01"))
+)
+logger = logging.getLogger(__name__)
 
-# Load environment variables
-load_dotenv()
+# Image detector settings
+# DETECTOR_BACKEND picks the runtime (keras, tflite or onnx); see convert_model.py
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND", "keras")
+DETECTOR_WARMUP = os.getenv("DETECTOR_WARMUP", "1") != "0"
+# Largest batch the detector compiles for and the batch scheduler forms
+DETECTOR_MAX_BATCH_SIZE = int(os.getenv("DETECTOR_MAX_BATCH_SIZE", "8"))
+# Number of inference worker processes (0 runs the model inside the API process)
+DETECTOR_WORKERS = int(os.getenv("DETECTOR_WORKERS", "0"))
+if DETECTOR_BACKEND not in MODEL_FILES:
+    raise ValueError(f"Unknown DETECTOR_BACKEND '{DETECTOR_BACKEND}'. Choose one of: {', '.join(MODEL_FILES)}")
+MODEL_PATH = os.getenv("MODEL_PATH") or os.path.join(os.path.dirname(__file__), MODEL_FILES[DETECTOR_BACKEND])  # Use relative path from API folder
 
-# Initialize the image detector
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "my_model.h5")  # Use relative path from API folder
-print(f"Looking for model at: {MODEL_PATH}")
+# Versioned models for hot swapping; MODEL_VERSION loads one of them at startup instead of MODEL_PATH
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR") or os.path.join(os.path.dirname(__file__), "models")
+MODEL_VERSION = os.getenv("MODEL_VERSION") or None
+registry = ModelRegistry(MODEL_REGISTRY_DIR)
 
-if not os.path.exists(MODEL_PATH):
-    print(f"Warning: Model file not found at {MODEL_PATH}")
-    print("The /detect endpoint will not be available until a valid model is provided.")
-else:
-    try:
-        print("Attempting to load model...")
-        initialize_detector(MODEL_PATH)
-        print(f"Model initialized successfully from {MODEL_PATH}")
-    except Exception as e:
-        print(f"Warning: Could not initialize detector: {str(e)}")
-        print("The /detect endpoint will not be available until the model is properly initialized.")
+# Batch concurrent /detect calls into a single forward pass
+DETECTOR_MAX_WAIT_MS = float(os.getenv("DETECTOR_MAX_WAIT_MS", "5"))
+DETECTOR_MAX_QUEUE_SIZE = int(os.getenv("DETECTOR_MAX_QUEUE_SIZE", "64"))
 
-# Configure Gemini AI
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-print(GEMINI_API_KEY)
+# Cache detection results for re-uploaded images (RESULT_CACHE_SIZE=0 disables it)
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "1024"))
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR") or None
 
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY not found in environment variables")
+# Largest single upload /detect accepts, and the chunk size uploads are read in.
+# Starlette spools uploads above 1 MB to a temp file, so big images never sit in RAM.
+DETECT_MAX_BYTES = int(os.getenv("DETECT_MAX_BYTES", str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Slack for the multipart boundaries and headers when checking Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
 
-genai.configure(api_key=GEMINI_API_KEY)
+# Limits for /detect/batch (a zip archive counts its image members and uncompressed size)
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", "500"))
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(200 * 1024 * 1024)))
+# Images from one batch request allowed in the detection queue at the same time
+BATCH_WINDOW = int(os.getenv("BATCH_WINDOW", "32"))
 
-# List available models to verify access
-try:
-    for m in genai.list_models():
-        if 'generateContent' in m.supported_generation_methods:
-            print(f"Found model: {m.name}")
-except Exception as e:
-    print(f"Error listing models: {str(e)}")
+# Upload size limits per path, checked against Content-Length before the body is read
+UPLOAD_LIMITS = {"/detect": DETECT_MAX_BYTES, "/detect/stream": DETECT_MAX_BYTES, "/detect/batch": BATCH_MAX_BYTES}
+
+# Gemini AI settings
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL_NAME = "gemini-2.0-flash-001"
 
-# Initialize the model with safety settings
 generation_config = {
     "temperature": 0.9,
     "top_p": 1,
@@ -68,18 +124,275 @@ safety_settings = [
     {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
 ]
 
-try:
-    model = genai.GenerativeModel(model_name="gemini-2.0-flash-001",
-                                generation_config=generation_config,
-                                safety_settings=safety_settings)
-except Exception as e:
-    print(f"Error initializing Gemini model: {str(e)}")
-    raise
+# LLM_PROVIDER picks who answers /chat and the advice: gemini (needs GEMINI_API_KEY)
+# or local, an offline stand-in that replies after LOCAL_LLM_LATENCY_MS
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LOCAL_LLM_LATENCY_MS = float(os.getenv("LOCAL_LLM_LATENCY_MS", "200"))
+# Calls running at once, calls allowed to wait beyond that, and the deadline per call (queueing included)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "256"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "30"))
+# Share one upstream call between concurrent requests with the same prompt
+LLM_COALESCE = os.getenv("LLM_COALESCE", "1") != "0"
+
+# Advice for a detected class is cached per (condition, prompt template, model config)
+ADVICE_CACHE_ENABLED = os.getenv("ADVICE_CACHE", "1") != "0"
+ADVICE_CACHE_TTL = float(os.getenv("ADVICE_CACHE_TTL", "86400"))
+# Fetch advice for every known condition at startup, and optionally refresh it periodically
+ADVICE_PRECOMPUTE = os.getenv("ADVICE_PRECOMPUTE", "0") != "0"
+ADVICE_REFRESH_SECONDS = float(os.getenv("ADVICE_REFRESH_SECONDS", "0"))
+advice_cache: Optional[AdviceCache] = None
+
+# Answer /chat from earlier answers to near-identical questions (SEMANTIC_CACHE=1 enables it).
+# SEMANTIC_CACHE_THRESHOLD is the cosine similarity a cached question needs to count as a match.
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE", "0") != "0"
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_TTL = float(os.getenv("SEMANTIC_CACHE_TTL", "86400"))
+# Longer prompts skip the cache: embedding them would cost more than it could save
+SEMANTIC_CACHE_MAX_CHARS = int(os.getenv("SEMANTIC_CACHE_MAX_CHARS", "2000"))
+semantic_cache: Optional[SemanticCache] = None
+
+# /chat and /detect record their exchanges in the chat history through a background writer
+# that inserts them in batches every HISTORY_FLUSH_MS (HISTORY_RECORD=0 turns it off)
+HISTORY_RECORD = os.getenv("HISTORY_RECORD", "1") != "0"
+HISTORY_FLUSH_MS = float(os.getenv("HISTORY_FLUSH_MS", "200"))
+HISTORY_BATCH_SIZE = int(os.getenv("HISTORY_BATCH_SIZE", "500"))
+HISTORY_MAX_BACKLOG = int(os.getenv("HISTORY_MAX_BACKLOG", "10000"))
+# GET /chat-history takes its total from a per-user counter; every HISTORY_COUNT_REBUILD_SECONDS
+# the counters are recounted from the rows in case they drifted (0 only on POST /admin/history/rebuild-counts)
+HISTORY_COUNT_REBUILD_SECONDS = float(os.getenv("HISTORY_COUNT_REBUILD_SECONDS", "86400"))
+
+# /detect uploads are kept in a content-addressed store under IMAGE_STORE_DIR (IMAGE_STORE=0 turns it off).
+# Every IMAGE_GC_INTERVAL_SECONDS, images no chat history row refers to are deleted once
+# they are older than IMAGE_GC_MIN_AGE_SECONDS.
+IMAGE_STORE_ENABLED = os.getenv("IMAGE_STORE", "1") != "0"
+IMAGE_STORE_DIR = os.getenv("IMAGE_STORE_DIR", "images")
+IMAGE_THUMBNAIL_SIZE = int(os.getenv("IMAGE_THUMBNAIL_SIZE", "256"))
+IMAGE_GC_INTERVAL_SECONDS = float(os.getenv("IMAGE_GC_INTERVAL_SECONDS", "86400"))
+IMAGE_GC_MIN_AGE_SECONDS = float(os.getenv("IMAGE_GC_MIN_AGE_SECONDS", "3600"))
+
+def configure_llm():
+    """Set up the LLM gateway. Leaves it unset when Gemini is selected but no API key is available."""
+    if LLM_PROVIDER == "gemini":
+        if not GEMINI_API_KEY:
+            logger.warning("GEMINI_API_KEY not found in environment variables. /chat and /detect will answer 503.")
+            return
+        provider = create_provider(
+            "gemini",
+            api_key=GEMINI_API_KEY,
+            model_name=GEMINI_MODEL_NAME,
+            generation_config=generation_config,
+            safety_settings=safety_settings
+        )
+    else:
+        provider = create_provider(LLM_PROVIDER, latency_ms=LOCAL_LLM_LATENCY_MS)
+    initialize_gateway(
+        provider,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        timeout=LLM_TIMEOUT,
+        max_queue=LLM_MAX_QUEUE,
+        coalesce=LLM_COALESCE
+    )
+
+def llm_http_error(e: LLMError) -> HTTPException:
+    """The HTTP error an LLM failure is reported as."""
+    if isinstance(e, LLMUnavailableError):
+        return HTTPException(status_code=503, detail=str(e))
+    if isinstance(e, LLMQueueFullError):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    if isinstance(e, LLMTimeoutError):
+        return HTTPException(status_code=504, detail=str(e))
+    return HTTPException(status_code=502, detail=f"LLM error: {str(e)}")
+
+def get_gateway_or_503() -> llm_gateway.LLMGateway:
+    try:
+        return get_gateway()
+    except LLMError as e:
+        raise llm_http_error(e)
+
+async def generate_text(prompt: str) -> str:
+    """Ask the LLM through the gateway and return the answer text, mapping failures to HTTP errors."""
+    try:
+        text = await get_gateway().generate(prompt)
+    except LLMError as e:
+        raise llm_http_error(e)
+    if not text:
+        raise HTTPException(status_code=500, detail="No response generated")
+    return text
+
+async def get_advice(class_name: str) -> str:
+    """Advice for a detected class, from the advice cache when it is enabled."""
+    if advice_cache is not None:
+        return await advice_cache.get(class_name)
+    return await generate_text(advice_prompt(class_name))
+
+def image_reference_counts() -> Dict[str, int]:
+    """Number of chat history rows referring to each stored image."""
+    db = SessionLocal()
+    try:
+        rows = db.query(models.ChatHistory.image_path, func.count(models.ChatHistory.id))\
+            .filter(models.ChatHistory.image_path.isnot(None))\
+            .group_by(models.ChatHistory.image_path)\
+            .all()
+        return {image_path: count for image_path, count in rows}
+    finally:
+        db.close()
+
+def collect_images() -> Dict[str, Any]:
+    """Delete stored images that no chat history row refers to."""
+    store = image_store.image_store
+    # Recorded rows may still be waiting in the history writer; none are older than the minimum age
+    return store.collect_garbage(image_reference_counts(), min_age_seconds=IMAGE_GC_MIN_AGE_SECONDS)
+
+async def collect_images_forever(interval_seconds: float):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_in_threadpool(collect_images)
+        except Exception:
+            logger.exception("Image store garbage collection failed")
+
+def rebuild_counts() -> Dict[str, Any]:
+    """Recount the chat history of every user and fix counters that drifted."""
+    with engine.begin() as connection:
+        return {"users_fixed": rebuild_history_counts(connection)}
+
+async def rebuild_counts_forever(interval_seconds: float):
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await run_in_threadpool(rebuild_counts)
+        except Exception:
+            logger.exception("Rebuilding the chat history counters failed")
+
+async def store_image(file: UploadFile, digest: str) -> Optional[str]:
+    """
+    Keep an upload in the image store, returning its digest, or None when the store
+    is off or the image could not be stored. Never fails the request.
+    """
+    store = image_store.image_store
+    if store is None:
+        return None
+    try:
+        return await run_in_threadpool(store.put, file.file, get_detector().image_size, digest)
+    except Exception as e:
+        logger.warning(f"Could not store uploaded image {file.filename}: {str(e)}")
+        return None
+
+def load_detector():
+    """Load and warm up the detection model. Runs in a background thread at startup."""
+    model_path, backend = MODEL_PATH, DETECTOR_BACKEND
+    if MODEL_VERSION:
+        try:
+            model_path, backend = registry.resolve(MODEL_VERSION)
+        except (KeyError, FileNotFoundError) as e:
+            detection_utils.detector_state = "failed"
+            detection_utils.detector_error = f"Model version {MODEL_VERSION} not found in {MODEL_REGISTRY_DIR}: {str(e)}"
+            logger.warning(detection_utils.detector_error)
+            return
+
+    logger.info(f"Looking for model at: {model_path}")
+    if not os.path.exists(model_path):
+        detection_utils.detector_state = "failed"
+        detection_utils.detector_error = f"Model file not found at {model_path}"
+        logger.warning(f"Model file not found at {model_path}. The /detect endpoint will not be available until a valid model is provided.")
+        return
+    if initialize_detector(
+        model_path,
+        backend=backend,
+        max_batch_size=DETECTOR_MAX_BATCH_SIZE,
+        warmup=DETECTOR_WARMUP,
+        workers=DETECTOR_WORKERS,
+        version=MODEL_VERSION
+    ):
+        logger.info(f"Model initialized successfully from {model_path}")
+    else:
+        logger.warning("Could not initialize detector. The /detect endpoint will not be available until the model is properly initialized.")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create database tables and bring older databases up to date
+    await run_in_threadpool(models.Base.metadata.create_all, bind=engine)
+    await run_in_threadpool(run_migrations, engine)
+
+    configure_llm()
+
+    initialize_batcher(
+        max_batch_size=DETECTOR_MAX_BATCH_SIZE,
+        max_wait_ms=DETECTOR_MAX_WAIT_MS,
+        max_queue_size=DETECTOR_MAX_QUEUE_SIZE,
+        concurrency=max(1, DETECTOR_WORKERS)
+    )
+    if RESULT_CACHE_SIZE > 0:
+        initialize_result_cache(max_entries=RESULT_CACHE_SIZE, ttl_seconds=RESULT_CACHE_TTL, disk_dir=RESULT_CACHE_DIR)
+
+    global advice_cache, semantic_cache
+    if HISTORY_RECORD:
+        initialize_history_writer(
+            SessionLocal,
+            flush_interval_ms=HISTORY_FLUSH_MS,
+            max_batch_size=HISTORY_BATCH_SIZE,
+            max_backlog=HISTORY_MAX_BACKLOG
+        )
+    if SEMANTIC_CACHE_ENABLED:
+        semantic_cache = SemanticCache(
+            max_entries=SEMANTIC_CACHE_SIZE,
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            ttl_seconds=SEMANTIC_CACHE_TTL,
+            max_chars=SEMANTIC_CACHE_MAX_CHARS
+        )
+
+    count_rebuilder = None
+    if HISTORY_COUNT_REBUILD_SECONDS > 0:
+        count_rebuilder = asyncio.create_task(rebuild_counts_forever(HISTORY_COUNT_REBUILD_SECONDS))
+
+    image_collector = None
+    if IMAGE_STORE_ENABLED:
+        initialize_image_store(IMAGE_STORE_DIR, thumbnail_size=IMAGE_THUMBNAIL_SIZE)
+        if IMAGE_GC_INTERVAL_SECONDS > 0:
+            image_collector = asyncio.create_task(collect_images_forever(IMAGE_GC_INTERVAL_SECONDS))
+
+    advice_refresher = None
+    if ADVICE_CACHE_ENABLED:
+        advice_cache = AdviceCache(
+            generate_text,
+            config_key=config_fingerprint(LLM_PROVIDER, GEMINI_MODEL_NAME, generation_config, safety_settings),
+            ttl_seconds=ADVICE_CACHE_TTL
+        )
+        if llm_gateway.gateway is not None and ADVICE_REFRESH_SECONDS > 0:
+            advice_refresher = asyncio.create_task(advice_cache.refresh_forever(ADVICE_REFRESH_SECONDS))
+        elif llm_gateway.gateway is not None and ADVICE_PRECOMPUTE:
+            advice_refresher = asyncio.create_task(advice_cache.precompute())
+
+    # Load the model in the background so routes that don't need it serve immediately
+    detection_utils.detector_state = "loading"
+    model_loader = threading.Thread(target=load_detector, name="model-loader", daemon=True)
+    model_loader.start()
+
+    yield
+
+    if advice_refresher is not None:
+        advice_refresher.cancel()
+    if image_collector is not None:
+        image_collector.cancel()
+    if count_rebuilder is not None:
+        count_rebuilder.cancel()
+    # Stop the batch scheduler first so no batch is sent to a closed detector
+    get_batcher().stop()
+    if detection_utils.detector is not None:
+        detection_utils.detector.close()
+    await close_gateway()
+    close_image_store()
+    # Last, so exchanges finished during shutdown are still written
+    stop_history_writer()
+    await async_engine.dispose()
 
 app = FastAPI(
     title="FastAPI with Gemini AI and Image Detection",
     description="A FastAPI application that integrates with Google's Gemini AI and provides image detection",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -89,42 +402,46 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # User management endpoints
 @app.post("/register", response_model=schemas.User)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = (await db.execute(select(models.User).where(models.User.email == user.email))).scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+    db_user = (await db.execute(select(models.User).where(models.User.username == user.username))).scalars().first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already taken")
     
-    hashed_password = security.get_password_hash(user.password)
+    hashed_password = await security.get_password_hash_async(user.password)
     db_user = models.User(
         email=user.email,
         username=user.username,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @app.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    # Try to find user by email first
-    user = db.query(models.User).filter(models.User.email == form_data.username or models.User.username == form_data.username).first()
-    # If not found by email, try username
-    if not user:
-        user = db.query(models.User).filter(models.User.username == form_data.username).first()
+    # The login field takes either the email or the username
+    user = (await db.execute(
+        select(models.User).where(or_(models.User.email == form_data.username, models.User.username == form_data.username))
+    )).scalars().first()
+    # Don't hold a connection while bcrypt runs
+    if user is not None:
+        db.expunge(user)
+    await db.rollback()
     
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    if not user or not await security.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -151,22 +468,71 @@ async def chat(
     current_user: models.User = Depends(security.get_current_user)
 ):
     try:
-        response = model.generate_content(request.message)
-        if response.text:
-            return schemas.ChatResponse(response=response.text)
-        else:
-            raise HTTPException(status_code=500, detail="No response generated")
+        # Embedding the prompt is CPU work, so it runs off the event loop
+        answer = await run_in_threadpool(semantic_cache.lookup, request.message) if semantic_cache else None
+        if answer is None:
+            answer = await generate_text(request.message)
+            if semantic_cache:
+                await run_in_threadpool(semantic_cache.store, request.message, answer)
+        record_history(current_user.id, request.message, answer)
+        return schemas.ChatResponse(response=answer)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# Updated image detection endpoint
-@app.post("/detect", response_model=schemas.ChatResponse)
-async def detect_image(
-    file: UploadFile = File(...),
-    current_user: models.User = Depends(security.get_current_user)
-):
+@app.middleware("http")
+async def track_request(request, call_next):
     """
-    Detect objects in the uploaded image using the loaded model.
+    Answer 413 from Content-Length before the upload body is received, and write
+    the sampled per-request summary line when request logging is on.
+    """
+    # Lets endpoints time the upload from the moment the request arrived
+    request.state.started_at = started_at = time.perf_counter()
+    limit = UPLOAD_LIMITS.get(request.url.path)
+    content_length = request.headers.get("content-length")
+    if request.method == "POST" and limit is not None and content_length and content_length.isdigit():
+        if int(content_length) > limit + MULTIPART_OVERHEAD:
+            return JSONResponse(
+                status_code=413,
+                content={"detail": f"Upload exceeds the {limit} byte limit"}
+            )
+    response = await call_next(request)
+    if sample_request():
+        request_logger.info("request", extra={
+            "method": request.method,
+            "path": request.url.path,
+            "status": response.status_code,
+            "duration_ms": round((time.perf_counter() - started_at) * 1000.0, 2),
+            "server_timing": response.headers.get("server-timing"),
+        })
+    return response
+
+async def read_upload(file: UploadFile, max_bytes: int) -> str:
+    """
+    Read an upload once in UPLOAD_CHUNK_SIZE chunks, returning its SHA-256 hex digest.
+    Raises 413 as soon as more than max_bytes have been read. The file is left rewound.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File size exceeds the {max_bytes} byte limit"
+            )
+        digest.update(chunk)
+    await file.seek(0)
+    return digest.hexdigest()
+
+async def detect_upload(file: UploadFile, started_at: float, timings: Timings) -> Tuple[Detection, str, str]:
+    """
+    Validate an image upload and run it through the batched detector. Returns the
+    detection, the top class name and the upload's digest; stage timings are added to `timings`.
     """
     # Validate file
     if not file:
@@ -188,72 +554,90 @@ async def detect_image(
             detail=f"Invalid file type: {file.content_type}. Only image files are allowed."
         )
     
-    # Check file size (optional, adjust limit as needed)
-    file_size = 0
+    # Single pass over the upload: enforce the size limit and hash it for the result cache
     try:
-        file_size = len(await file.read())
-        await file.seek(0)  # Reset file pointer
+        digest = await read_upload(file, DETECT_MAX_BYTES)
+        # Receiving and parsing the multipart body happens before the handler runs, so count it
+        # too; the auth dependency also ran in between and is its own stage
+        timings.add("upload", time.perf_counter() - started_at - timings.get("auth", 0.0))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=400,
             detail=f"Error reading file: {str(e)}"
         )
+
+    # Make sure the detector is available
+    try:
+        get_detector()
+    except Exception as e:
+        raise HTTPException(
+            status_code=503,
+            detail=f"Model initialization error: {str(e)}"
+        )
     
-    if file_size > 10 * 1024 * 1024:  # 10MB limit
+    # Perform detection (batched with other concurrent requests)
+    try:
+        # The decoder reads the spooled upload in place instead of a copy of its bytes.
+        # The result cache lookup may read from disk, so it stays off the event loop.
+        future = await run_in_threadpool(submit_detection, file.file, digest=digest)
+    except QueueFullError as e:
         raise HTTPException(
-            status_code=400,
-            detail="File size exceeds 10MB limit"
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": "1"}
         )
-        
     try:
-        # Check if model is available
-        if not os.path.exists(MODEL_PATH):
-            raise HTTPException(
-                status_code=503,
-                detail="Model file not found. Please ensure my_model.h5 exists in the API folder."
-            )
-            
-        # Read the image file
-        try:
-            image_data = await file.read()
-        except Exception as e:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Error reading image file: {str(e)}"
-            )
-        
-        # Get the detector
-        try:
-            detector = get_detector()
-        except Exception as e:
-            raise HTTPException(
-                status_code=503,
-                detail=f"Model initialization error: {str(e)}"
-            )
-        
-        # Perform detection
-        try:
-            predictions, confidence_scores, processing_time = detector.predict(image_data)
-            answer = "Hay giup toi dua ra loi khuyen cho can benh "
-            if predictions[0]['class_name'] == "class_7":
-                answer += "shingles"
-            elif predictions[0]['class_name'] == "class_2":
-                answer += "dd"
-            elif predictions[0]['class_name'] == "class_3":
-                answer += "dd"
-            else:
-                answer += "dd"
-        except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error processing image: {str(e)}"
-            )
-            
-        response = model.generate_content(answer)
-        if response.text:
-            return schemas.ChatResponse(response=response.text)
-        else:
-            raise HTTPException(status_code=500, detail="No response generated")
+        detection = await asyncio.wrap_future(future)
+        class_name = detection.predictions[0]['class_name']
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"Error processing image: {str(e)}"
+        )
+    timings.update(detection.timings or {})
+    return detection, class_name, digest
+
+def detection_message(file: UploadFile, class_name: str) -> str:
+    """What a /detect exchange is recorded as in the chat history."""
+    return f"Detected {class_name} in {file.filename}"
+
+# Updated image detection endpoint
+@app.post("/detect", response_model=schemas.ChatResponse)
+async def detect_image(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Detect objects in the uploaded image using the loaded model.
+    The time spent in each stage is returned in the Server-Timing header.
+    """
+    started_at = getattr(request.state, "started_at", time.perf_counter())
+    timings = Timings(auth=getattr(request.state, "auth_seconds", 0.0))
+    try:
+        detection, class_name, digest = await detect_upload(file, started_at, timings)
+        # The detector is done with the upload, so it can be stored while the advice is generated
+        stored = asyncio.ensure_future(store_image(file, digest))
+        with timings.stage("advice"):
+            advice = await get_advice(class_name)
+        image_path = await stored
+        timings.add("total", time.perf_counter() - started_at)
+
+        # Pipeline stages were recorded by the batch scheduler; add the ones only /detect sees
+        for stage in ("auth", "upload", "advice", "total"):
+            detection_stages.observe(stage, timings[stage])
+        response.headers["Server-Timing"] = timings.server_timing()
+        record_history(
+            current_user.id,
+            detection_message(file, class_name),
+            advice,
+            image_path=image_path,
+            model_version=detection.model_version
+        )
+        return schemas.ChatResponse(response=advice, model_version=detection.model_version, image_path=image_path)
 
         # return schemas.DetectionResponse(
         #     predictions=predictions,
@@ -270,43 +654,346 @@ async def detect_image(
             detail=f"An unexpected error occurred: {str(e)}"
         )
 
+def sse_event(event: str, data: Any) -> str:
+    """One server-sent event with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+# Stop proxies (nginx in particular) from buffering the stream, which would defeat its purpose
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+async def stream_advice(class_name: str) -> AsyncIterator[str]:
+    """
+    Advice for a detected class as it is generated. A cached answer arrives as one
+    piece; a freshly streamed one is cached once it is complete.
+    """
+    if advice_cache is None:
+        async for chunk in get_gateway().stream(advice_prompt(class_name)):
+            yield chunk
+        return
+    answer = advice_cache.lookup(class_name)
+    if answer is not None:
+        yield answer
+        return
+    parts = []
+    async for chunk in get_gateway().stream(advice_cache.prompt(class_name)):
+        parts.append(chunk)
+        yield chunk
+    advice_cache.store(class_name, "".join(parts))
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: schemas.ChatRequest,
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Same as /chat, but the answer streams back as server-sent events: `token` events
+    with {"text": ...} as the LLM produces them, then `done`. A failure after the
+    first token arrives as an `error` event.
+    """
+    user_id = current_user.id
+    answer = await run_in_threadpool(semantic_cache.lookup, request.message) if semantic_cache else None
+    if answer is not None:
+        record_history(user_id, request.message, answer)
+
+        async def cached():
+            yield sse_event("token", {"text": answer})
+            yield sse_event("done", {})
+        return StreamingResponse(cached(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+    chunks = get_gateway_or_503().stream(request.message)
+    # Wait for the first piece before answering, so a full queue or a timeout still gets a real status code
+    try:
+        first = await chunks.__anext__()
+    except StopAsyncIteration:
+        raise HTTPException(status_code=500, detail="No response generated")
+    except LLMError as e:
+        raise llm_http_error(e)
+
+    async def events():
+        parts = [first]
+        yield sse_event("token", {"text": first})
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield sse_event("token", {"text": chunk})
+        except LLMError as e:
+            yield sse_event("error", {"status_code": llm_http_error(e).status_code, "detail": str(e)})
+            return
+        answer = "".join(parts)
+        if semantic_cache:
+            await run_in_threadpool(semantic_cache.store, request.message, answer)
+        record_history(user_id, request.message, answer)
+        yield sse_event("done", {})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.post("/detect/stream")
+async def detect_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Same as /detect, but streamed as server-sent events: a `detection` event with the
+    predictions as soon as the model has run, `token` events as the advice is
+    generated, then `done` with the stage timings. Upload and detection errors are
+    still plain HTTP errors; an advice failure arrives as an `error` event.
+    """
+    started_at = getattr(request.state, "started_at", time.perf_counter())
+    timings = Timings(auth=getattr(request.state, "auth_seconds", 0.0))
+    detection, class_name, digest = await detect_upload(file, started_at, timings)
+    detection_stages.observe("auth", timings["auth"])
+    detection_stages.observe("upload", timings["upload"])
+    user_id, message = current_user.id, detection_message(file, class_name)
+    stored = asyncio.ensure_future(store_image(file, digest))
+
+    async def events():
+        yield sse_event("detection", detection._asdict())
+        advice_started = time.perf_counter()
+        parts = []
+        try:
+            async for chunk in stream_advice(class_name):
+                if "advice_first_token" not in timings:
+                    timings.add("advice_first_token", time.perf_counter() - advice_started)
+                parts.append(chunk)
+                yield sse_event("token", {"text": chunk})
+        except LLMError as e:
+            yield sse_event("error", {"status_code": llm_http_error(e).status_code, "detail": str(e)})
+            return
+        timings.add("advice", time.perf_counter() - advice_started)
+        timings.add("total", time.perf_counter() - started_at)
+        for stage in ("advice_first_token", "advice", "total"):
+            if stage in timings:
+                detection_stages.observe(stage, timings[stage])
+        image_path = await stored
+        record_history(user_id, message, "".join(parts), image_path=image_path, model_version=detection.model_version)
+        yield sse_event("done", {"model_version": detection.model_version, "image_path": image_path, "timings": timings})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".gif", ".webp", ".tif", ".tiff")
+
+def _is_zip(file: UploadFile) -> bool:
+    return file.content_type in ("application/zip", "application/x-zip-compressed") or \
+        (file.filename or "").lower().endswith(".zip")
+
+def _batch_entries(files: List[UploadFile]) -> List[Tuple[str, Callable[[], Awaitable[bytes]]]]:
+    """
+    Expand the uploaded files (and the images inside any zip archive) into (name, reader) pairs.
+    Raises HTTPException when the batch is over the file count or size limits.
+    """
+    entries = []
+    total_bytes = 0
+    for file in files:
+        if _is_zip(file):
+            try:
+                archive = zipfile.ZipFile(file.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{file.filename} is not a valid zip archive")
+            for member in archive.infolist():
+                if member.is_dir() or not member.filename.lower().endswith(IMAGE_EXTENSIONS):
+                    continue
+                total_bytes += member.file_size
+                entries.append((
+                    f"{file.filename}/{member.filename}",
+                    lambda archive=archive, member=member: run_in_threadpool(archive.read, member)
+                ))
+        else:
+            if not (file.content_type or "").startswith("image/"):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Invalid file type for {file.filename}: {file.content_type}. Only images and zip archives are allowed."
+                )
+            total_bytes += file.size or 0
+            entries.append((file.filename, file.read))
+
+        if len(entries) > BATCH_MAX_FILES:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds the {BATCH_MAX_FILES} image limit")
+        if total_bytes > BATCH_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"Batch exceeds the {BATCH_MAX_BYTES} byte limit")
+    return entries
+
+@app.post("/detect/batch")
+async def detect_batch(
+    files: List[UploadFile] = File(...),
+    current_user: models.User = Depends(security.get_current_user)
+):
+    """
+    Detect many images in one request, from individual files and/or zip archives.
+    Results stream back as NDJSON, one line per image in completion order.
+    """
+    try:
+        get_detector()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Model initialization error: {str(e)}")
+
+    entries = _batch_entries(files)
+    window = max(1, min(BATCH_WINDOW, DETECTOR_MAX_QUEUE_SIZE))
+
+    async def results():
+        pending = {}
+        next_index = 0
+        # Bytes of entries[next_index] when the queue turned it away; reading an upload again gives b""
+        unqueued = None
+        while next_index < len(entries) or pending:
+            # Keep up to `window` images queued so the scheduler can form full batches
+            while next_index < len(entries) and len(pending) < window:
+                name, read = entries[next_index]
+                try:
+                    if unqueued is None:
+                        unqueued = await read()
+                    # Hashing and the result cache lookup (possibly on disk) stay off the event loop
+                    future = await run_in_threadpool(submit_detection, unqueued)
+                except QueueFullError:
+                    if pending:
+                        break
+                    # Other requests filled the queue; give it a moment to drain
+                    await asyncio.sleep(DETECTOR_MAX_WAIT_MS / 1000.0 + 0.01)
+                    continue
+                except Exception as e:
+                    yield json.dumps({"index": next_index, "filename": name, "error": str(e)}) + "\n"
+                    unqueued = None
+                    next_index += 1
+                    continue
+                pending[asyncio.wrap_future(future)] = (next_index, name)
+                unqueued = None
+                next_index += 1
+
+            if not pending:
+                continue
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for finished in done:
+                index, name = pending.pop(finished)
+                try:
+                    detection = finished.result()
+                    line = {"index": index, "filename": name, **detection._asdict()}
+                except Exception as e:
+                    line = {"index": index, "filename": name, "error": str(e)}
+                yield json.dumps(line) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to FastAPI with Gemini AI and User Management"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Per-stage detection latency histograms in the Prometheus text format."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+async def _database_reachable() -> bool:
+    try:
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: the model is loaded and warmed up, the database answers and the LLM is configured."""
+    current = detection_utils.detector
+    # Worker processes of an inference pool that have died and are being restarted
+    lost_workers = current.lost_workers() if hasattr(current, "lost_workers") else 0
+    checks = {
+        "model": {
+            "ready": current is not None and lost_workers == 0,
+            "state": detection_utils.detector_state,
+            "error": detection_utils.detector_error,
+            "warmup_seconds": current.warmup_seconds if current else None,
+            "lost_workers": lost_workers,
+        },
+        "database": {"ready": await _database_reachable()},
+        "llm": {"ready": llm_gateway.gateway is not None},
+    }
+    ready = all(check["ready"] for check in checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "checks": checks}
+    )
+
 # Chat History Endpoints
 @app.post("/chat-history", response_model=schemas.ChatHistory)
 async def create_chat_history(
     chat: schemas.ChatHistoryCreate,
     current_user: models.User = Depends(security.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     db_chat = models.ChatHistory(
         user_id=current_user.id,
         message=chat.message,
         response=chat.response,
-        image_path=chat.image_path
+        image_path=chat.image_path,
+        model_version=chat.model_version
     )
     db.add(db_chat)
-    db.commit()
-    db.refresh(db_chat)
+    await db.run_sync(add_history_counts, [current_user.id])
+    await db.commit()
+    await db.refresh(db_chat)
     return db_chat
 
+def history_page(query, cursor: Optional[str], skip: int, limit: int):
+    """One newest-first page of a chat history query, after `cursor` and then `skip` rows."""
+    try:
+        query = pagination.newest_first(query, models.ChatHistory.created_at, models.ChatHistory.id, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return query.offset(skip)
+
 @app.get("/chat-history", response_model=schemas.ChatHistoryList)
 async def get_chat_history(
     skip: int = Query(0, ge=0),
     limit: int = Query(10, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    current_user: models.User = Depends(security.get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    The user's chat history, newest first. Follow next_cursor for the following pages:
+    every page then costs the same however deep it is. skip still works, but each
+    skipped row is read and thrown away.
+    """
+    query = history_page(select(models.ChatHistory).where(models.ChatHistory.user_id == current_user.id), cursor, skip, limit)
+    chats, next_cursor = pagination.page((await db.execute(query)).scalars().all(), limit)
+    # The counter was loaded with the user, so the total costs no query
+    return {"items": chats, "total": current_user.history_count, "next_cursor": next_cursor}
+
+@app.get("/images/{digest}")
+async def get_image(
+    digest: str,
+    variant: str = Query("original", pattern="^(original|thumbnail|model)$"),
     current_user: models.User = Depends(security.get_current_user),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    total = db.query(models.ChatHistory).filter(models.ChatHistory.user_id == current_user.id).count()
-    chats = db.query(models.ChatHistory)\
-        .filter(models.ChatHistory.user_id == current_user.id)\
-        .order_by(models.ChatHistory.created_at.desc())\
-        .offset(skip)\
-        .limit(limit)\
-        .all()
-    return {"items": chats, "total": total}
+    """
+    A stored upload, by the digest in its chat history row's image_path: the original,
+    a thumbnail or the model-resolution version. Range requests are supported. Users
+    can fetch the images in their own history; admins can fetch any.
+    """
+    store = image_store.image_store
+    if store is None or not store.is_digest(digest):
+        raise HTTPException(status_code=404, detail="Image not found")
+    if not current_user.is_admin:
+        owned = (await db.execute(
+            select(models.ChatHistory.id)
+            .where(models.ChatHistory.image_path == digest, models.ChatHistory.user_id == current_user.id)
+            .limit(1)
+        )).first()
+        if owned is None:
+            raise HTTPException(status_code=404, detail="Image not found")
+    try:
+        model_size = detection_utils.detector.image_size if detection_utils.detector is not None else None
+        path, media_type = await run_in_threadpool(store.path, digest, variant, model_size)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Image not found")
+    # Content-addressed, so a stored file never changes
+    return FileResponse(path, media_type=media_type, headers={"Cache-Control": "private, max-age=31536000, immutable"})
 
 # User Management Endpoints (Admin only)
 @app.get("/admin/users", response_model=List[schemas.User])
@@ -315,15 +1002,15 @@ async def get_users(
     limit: int = 10,
     search: str = "",
     current_user: models.User = Depends(security.get_current_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = db.query(models.User)
+    query = select(models.User)
     if search:
-        query = query.filter(
+        query = query.where(
             (models.User.username.ilike(f"%{search}%")) |
             (models.User.email.ilike(f"%{search}%"))
         )
-    users = query.offset(skip).limit(limit).all()
+    users = (await db.execute(query.offset(skip).limit(limit))).scalars().all()
     return users
 
 @app.put("/admin/users/{user_id}", response_model=schemas.User)
@@ -331,52 +1018,190 @@ async def update_user(
     user_id: int,
     user_update: schemas.UserUpdate,
     current_user: models.User = Depends(security.get_current_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    db_user = await db.get(models.User, user_id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
     update_data = user_update.dict(exclude_unset=True)
     if "password" in update_data:
-        update_data["hashed_password"] = security.get_password_hash(update_data.pop("password"))
+        update_data["hashed_password"] = await security.get_password_hash_async(update_data.pop("password"))
     
     for key, value in update_data.items():
         setattr(db_user, key, value)
     
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @app.delete("/admin/users/{user_id}")
 async def delete_user(
     user_id: int,
     current_user: models.User = Depends(security.get_current_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    db_user = db.query(models.User).filter(models.User.id == user_id).first()
+    # Load the history up front: deleting the user clears user_id on its rows, and async sessions can't lazy load them
+    db_user = await db.get(models.User, user_id, options=[selectinload(models.User.chat_histories)])
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    db.delete(db_user)
-    db.commit()
+    await db.delete(db_user)
+    await db.commit()
     return {"message": "User deleted successfully"}
 
+@app.get("/admin/detector/stats")
+async def get_detector_stats(
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    cache = detection_utils.result_cache
+    current = detection_utils.detector
+    return {
+        "detector": current.describe() if current else None,
+        "batcher": get_batcher().stats(),
+        "result_cache": cache.stats() if cache else None,
+        "stages": detection_stages.snapshot(),
+    }
+
+@app.get("/admin/llm/stats")
+async def get_llm_stats(
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    return {
+        "configured": llm_gateway.gateway is not None,
+        "gateway": llm_gateway.gateway.stats() if llm_gateway.gateway else None,
+        "advice_cache": advice_cache.stats() if advice_cache else None,
+        "semantic_cache": semantic_cache.stats() if semantic_cache else None,
+    }
+
+@app.get("/admin/history/stats")
+async def get_history_stats(
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    writer = history_writer.history_writer
+    return {
+        "recording": writer is not None,
+        "writer": writer.stats() if writer else None,
+    }
+
+@app.post("/admin/history/rebuild-counts")
+async def rebuild_history_count_totals(
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    """Recount every user's chat history now, as the periodic job does."""
+    return await run_in_threadpool(rebuild_counts)
+
+@app.get("/admin/images/stats")
+async def get_image_stats(
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    store = image_store.image_store
+    return {
+        "enabled": store is not None,
+        "store": await run_in_threadpool(store.stats) if store else None,
+    }
+
+@app.post("/admin/images/gc")
+async def collect_image_garbage(
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    """Delete stored images that no chat history row refers to any more."""
+    if image_store.image_store is None:
+        raise HTTPException(status_code=404, detail="Image store is disabled")
+    return await run_in_threadpool(collect_images)
+
+@app.get("/admin/logging", response_model=schemas.LoggingSettings)
+async def get_logging(
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    return log_config.logging_settings()
+
+@app.put("/admin/logging", response_model=schemas.LoggingSettings)
+async def update_logging(
+    settings: schemas.LoggingUpdate,
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    """Change the log level and per-request logging without a restart."""
+    if settings.level is not None:
+        log_config.set_level(settings.level)
+    if settings.request_log is not None or settings.request_log_sample_rate is not None:
+        enabled = settings.request_log if settings.request_log is not None else log_config.request_log_enabled
+        log_config.set_request_logging(enabled, settings.request_log_sample_rate)
+    logger.info(f"Logging settings changed by {current_user.username}: {log_config.logging_settings()}")
+    return log_config.logging_settings()
+
+@app.get("/admin/models", response_model=schemas.ModelList)
+async def list_models(
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    current = detection_utils.detector
+    return {
+        "active": current.model_version if current else None,
+        "versions": await run_in_threadpool(registry.versions)
+    }
+
+# Only one model may be loading for activation at a time
+model_activation_lock = asyncio.Lock()
+
+@app.post("/admin/models/{version}/activate")
+async def activate_model(
+    version: str,
+    current_user: models.User = Depends(security.get_current_admin)
+):
+    """
+    Load and warm up a registry version, then make it the active model.
+    Batches already running finish on the previous model, which is released afterwards.
+    """
+    try:
+        model_path, backend = registry.resolve(version)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Model version {version} not found")
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    if model_activation_lock.locked():
+        raise HTTPException(status_code=409, detail="Another model is being activated")
+
+    async with model_activation_lock:
+        try:
+            new_detector = await run_in_threadpool(
+                create_detector,
+                model_path,
+                backend=backend,
+                max_batch_size=DETECTOR_MAX_BATCH_SIZE,
+                warmup=DETECTOR_WARMUP,
+                workers=DETECTOR_WORKERS,
+                version=version
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Could not load model version {version}: {str(e)}")
+
+        old_detector = swap_detector(new_detector)
+        if old_detector is not None:
+            threading.Thread(target=retire_detector, args=(old_detector,), name="model-retire", daemon=True).start()
+
+    return {"active": new_detector.describe()}
+
 @app.get("/admin/chat-history", response_model=List[schemas.ChatHistory])
 async def get_all_chat_history(
+    response: Response,
     skip: int = 0,
     limit: int = 10,
     search: str = "",
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(security.get_current_admin),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = db.query(models.ChatHistory)
+    """Everyone's chat history, newest first. The X-Next-Cursor header holds the cursor of the next page."""
+    query = select(models.ChatHistory)
     if search:
-        query = query.filter(
+        query = query.where(
             (models.ChatHistory.message.ilike(f"%{search}%")) |
             (models.ChatHistory.response.ilike(f"%{search}%"))
         )
-    chat_history = query.offset(skip).limit(limit).all()
+    chat_history, next_cursor = pagination.page((await db.execute(history_page(query, cursor, skip, limit))).scalars().all(), limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return chat_history
 
 if __name__ == "__main__":
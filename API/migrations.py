@@ -0,0 +1,74 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Schema changes for databases created before a column or index existed.
+# create_all() only creates missing tables, so every later change to an existing
+# table goes here. Each step must be safe on a fresh database where create_all()
+# already produced the final schema.
+
+
+def _add_column(connection: Connection, table: str, column: str, ddl: str):
+    columns = {c["name"] for c in inspect(connection).get_columns(table)}
+    if column not in columns:
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+
+def _0001_chat_history_model_version(connection: Connection):
+    _add_column(connection, "chat_histories", "model_version", "VARCHAR")
+
+
+def _0002_chat_history_image_path_index(connection: Connection):
+    # Image ownership checks and image store garbage collection look rows up by image_path
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chat_histories_image_path ON chat_histories (image_path)"
+    ))
+
+
+def _0003_chat_history_keyset_indexes(connection: Connection):
+    # GET /chat-history and /admin/chat-history page through (created_at, id), newest first
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chat_histories_user_id_created_at_id "
+        "ON chat_histories (user_id, created_at, id)"
+    ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chat_histories_created_at_id ON chat_histories (created_at, id)"
+    ))
+
+
+def _0004_user_history_count(connection: Connection):
+    # GET /chat-history reads the total from this counter instead of counting rows
+    _add_column(connection, "users", "history_count", "INTEGER NOT NULL DEFAULT 0")
+    connection.execute(text(
+        "UPDATE users SET history_count = "
+        "(SELECT COUNT(*) FROM chat_histories WHERE chat_histories.user_id = users.id)"
+    ))
+
+
+MIGRATIONS = [
+    ("0001_chat_history_model_version", _0001_chat_history_model_version),
+    ("0002_chat_history_image_path_index", _0002_chat_history_image_path_index),
+    ("0003_chat_history_keyset_indexes", _0003_chat_history_keyset_indexes),
+    ("0004_user_history_count", _0004_user_history_count),
+]
+
+
+def run_migrations(engine: Engine):
+    """Apply every migration that has not been recorded in schema_migrations yet."""
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "name VARCHAR PRIMARY KEY, "
+            "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        applied = {row[0] for row in connection.execute(text("SELECT name FROM schema_migrations"))}
+
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(text("INSERT INTO schema_migrations (name) VALUES (:name)"), {"name": name})
+        logger.info(f"Applied migration {name}")
@@ -0,0 +1,61 @@
+import os
+from typing import Any, Dict, List, Tuple
+
+from inference_backends import MODEL_FILES
+
+# Backend for each artifact extension, e.g. ".onnx" -> "onnx"
+BACKEND_BY_EXTENSION = {os.path.splitext(name)[1]: backend for backend, name in MODEL_FILES.items()}
+
+
+class ModelRegistry:
+    """
+    A directory of versioned model artifacts.
+
+    Each version is a subdirectory holding one artifact whose extension selects the backend:
+
+        models/
+            2024-05-01/my_model.h5
+            2024-06-12/my_model.onnx
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _artifact(self, version: str) -> Tuple[str, str]:
+        """Return (path, backend) of the artifact stored for `version`."""
+        directory = os.path.join(self.root, version)
+        if not os.path.isdir(directory):
+            raise KeyError(version)
+        for name in sorted(os.listdir(directory)):
+            backend = BACKEND_BY_EXTENSION.get(os.path.splitext(name)[1])
+            if backend is not None:
+                return os.path.join(directory, name), backend
+        raise FileNotFoundError(f"No model artifact found for version {version}")
+
+    def resolve(self, version: str) -> Tuple[str, str]:
+        """
+        Return (path, backend) for a version.
+        Raises KeyError for unknown versions and FileNotFoundError when the version has no artifact.
+        """
+        # Version names are directory names; never let them point outside the registry
+        if not version or os.path.basename(version) != version or version in (".", ".."):
+            raise KeyError(version)
+        return self._artifact(version)
+
+    def versions(self) -> List[Dict[str, Any]]:
+        """List every version with a loadable artifact, oldest name first."""
+        if not os.path.isdir(self.root):
+            return []
+        versions = []
+        for version in sorted(os.listdir(self.root)):
+            try:
+                path, backend = self._artifact(version)
+            except (KeyError, FileNotFoundError):
+                continue
+            versions.append({
+                "version": version,
+                "backend": backend,
+                "path": path,
+                "size_bytes": os.path.getsize(path),
+            })
+        return versions
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, DateTime, Text
+from sqlalchemy import Boolean, Column, ForeignKey, Index, Integer, String, DateTime, Text
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from database import Base
@@ -15,6 +15,8 @@ class User(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     is_admin = Column(Boolean, default=False)
+    # Number of chat_histories rows, kept up to date by history_counts
+    history_count = Column(Integer, nullable=False, default=0, server_default="0")
     
     # Relationships
     chat_histories = relationship("ChatHistory", back_populates="user")
@@ -26,8 +28,15 @@ class ChatHistory(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     message = Column(Text)
     response = Column(Text)
-    image_path = Column(String, nullable=True)
+    image_path = Column(String, nullable=True, index=True)
+    model_version = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     # Relationships
-    user = relationship("User", back_populates="chat_histories") 
\ No newline at end of file
+    user = relationship("User", back_populates="chat_histories")
+
+    # Keyset pagination, newest first: a user's history, and everyone's for the admin listing
+    __table_args__ = (
+        Index("ix_chat_histories_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index("ix_chat_histories_created_at_id", "created_at", "id"),
+    ) 
\ No newline at end of file
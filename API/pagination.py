@@ -0,0 +1,53 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Select, tuple_
+from sqlalchemy.orm import InstrumentedAttribute
+
+# Keyset ("seek") pagination over (created_at, id), newest first.
+#
+# An offset page makes the database walk past every row before it, so page 1000 costs
+# a thousand pages of work. A cursor holds the sort key of the last row returned, and
+# the next page starts right after it in the (created_at, id) index, whatever its depth.
+# id breaks ties between rows stamped with the same created_at. Cursors are opaque to
+# clients: URL-safe base64 of the JSON [created_at, id].
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """(created_at, id) of a cursor from encode_cursor(). Raises ValueError if it is malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        if not isinstance(row_id, int):
+            raise ValueError
+        return datetime.fromisoformat(created_at), row_id
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError("Invalid cursor")
+
+
+def newest_first(query: Select, created_at: InstrumentedAttribute, id_: InstrumentedAttribute, cursor: Optional[str], limit: int) -> Select:
+    """
+    `query` ordered newest first, limited to one page after `cursor`. One extra row is
+    fetched so page() can tell whether another page follows.
+    """
+    if cursor:
+        after_created_at, after_id = decode_cursor(cursor)
+        query = query.where(tuple_(created_at, id_) < tuple_(after_created_at, after_id))
+    return query.order_by(created_at.desc(), id_.desc()).limit(limit + 1)
+
+
+def page(rows: Sequence[Any], limit: int) -> Tuple[List[Any], Optional[str]]:
+    """Split the rows of a newest_first() query into the page and the cursor of the next one (None on the last page)."""
+    items = list(rows[:limit])
+    if len(rows) <= limit or not items:
+        return items, None
+    last = items[-1]
+    return items, encode_cursor(last.created_at, last.id)
@@ -1,5 +1,5 @@
-from pydantic import BaseModel, EmailStr
-from typing import Optional, List, Dict, Any
+from pydantic import BaseModel, EmailStr, Field
+from typing import Optional, List, Dict, Any, Literal
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -19,6 +19,7 @@ class User(UserBase):
     is_admin: bool
     created_at: datetime
     updated_at: Optional[datetime] = None
+    history_count: int = 0
 
     class Config:
         from_attributes = True
@@ -43,6 +44,9 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     response: str
+    model_version: Optional[str] = None
+    # Digest of the stored upload for /detect; fetch it from /images/{image_path}
+    image_path: Optional[str] = None
 
 class DetectionResponse(BaseModel):
     predictions: List[Dict[str, Any]]
@@ -53,6 +57,7 @@ class ChatHistoryBase(BaseModel):
     message: str
     response: str
     image_path: Optional[str] = None
+    model_version: Optional[str] = None
 
 class ChatHistoryCreate(ChatHistoryBase):
     pass
@@ -65,9 +70,32 @@ class ChatHistory(ChatHistoryBase):
     class Config:
         from_attributes = True
 
+class ModelVersion(BaseModel):
+    version: str
+    backend: str
+    path: str
+    size_bytes: int
+
+class ModelList(BaseModel):
+    active: Optional[str] = None
+    versions: List[ModelVersion]
+
+class LoggingSettings(BaseModel):
+    level: str
+    request_log: bool
+    request_log_sample_rate: float
+    dropped_records: int
+
+class LoggingUpdate(BaseModel):
+    level: Optional[Literal["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]] = None
+    request_log: Optional[bool] = None
+    request_log_sample_rate: Optional[float] = Field(default=None, ge=0.0, le=1.0)
+
 class ChatHistoryList(BaseModel):
     items: List[ChatHistory]
     total: int
+    # Pass as `cursor` to get the next page; None on the last one
+    next_cursor: Optional[str] = None
 
 class UserList(BaseModel):
     items: List[User]
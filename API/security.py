@@ -2,14 +2,20 @@ from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 import bcrypt
+import logging
+import time
 
 import models
 import schemas
-from database import get_db
+from database import get_async_db
+
+logger = logging.getLogger(__name__)
 
 # Security configuration
 SECRET_KEY = "your-secret-key-keep-it-secret"  # Change this in production!
@@ -29,14 +35,14 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     try:
         return pwd_context.verify(plain_password, hashed_password)
     except Exception as e:
-        print(f"Password verification error: {str(e)}")
+        logger.warning(f"Password verification error: {str(e)}")
         return False
 
 def get_password_hash(password: str) -> str:
     try:
         return pwd_context.hash(password)
     except Exception as e:
-        print(f"Password hashing error: {str(e)}")
+        logger.warning(f"Password hashing error: {str(e)}")
         # Fallback to direct bcrypt if passlib fails
         salt = bcrypt.gensalt()
         return bcrypt.hashpw(password.encode(), salt).decode()
@@ -51,7 +57,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password() on a worker thread; bcrypt takes a few hundred milliseconds of CPU."""
+    return await run_in_threadpool(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash() on a worker thread."""
+    return await run_in_threadpool(get_password_hash, password)
+
+async def get_current_user(request: Request, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):
+    started = time.perf_counter()
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -65,9 +80,16 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         token_data = schemas.TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.email == token_data.email).first()
+    user = (await db.execute(select(models.User).where(models.User.email == token_data.email))).scalars().first()
     if user is None:
         raise credentials_exception
+    # Hand the connection back to the pool now rather than when the response is done,
+    # so requests that wait on the detector or the LLM don't hold one. The user keeps
+    # its loaded attributes; endpoints that query again check out a fresh connection.
+    db.expunge(user)
+    await db.rollback()
+    # Endpoints that report stage timings show this as "auth" rather than as part of the upload
+    request.state.auth_seconds = time.perf_counter() - started
     return user
 
 async def get_current_admin(current_user: models.User = Depends(get_current_user)):
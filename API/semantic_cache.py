@@ -0,0 +1,133 @@
+import re
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+NGRAM_SIZES = (3, 4, 5)
+
+
+def embed(text: str, dim: int = 1024, ngram_sizes: Tuple[int, ...] = NGRAM_SIZES) -> np.ndarray:
+    """
+    Unit-length vector of the hashed character n-grams in `text` (case and
+    punctuation ignored). Needs no model or network, and the same text always
+    maps to the same vector.
+    """
+    normalized = " " + " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split()) + " "
+    vector = np.zeros(dim, dtype=np.float32)
+    for n in ngram_sizes:
+        for i in range(len(normalized) - n + 1):
+            h = zlib.crc32(normalized[i:i + n].encode())
+            # The top bit picks the sign, so colliding n-grams tend to cancel instead of adding up
+            vector[h % dim] += 1.0 if h & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+class SemanticCache:
+    """
+    Caches LLM answers by prompt similarity rather than exact text.
+
+    Prompts are embedded with embed() into one preallocated matrix, so a lookup is a
+    single matrix-vector product. A cached answer is returned when the most similar
+    prompt scores at least `threshold` (cosine similarity). Character n-grams measure
+    wording, not meaning: "signs of shingles" and "signs of eczema" score around 0.77,
+    so keep the threshold high enough that only rewordings of the same question match.
+    When full, the least recently used entry is replaced. Embedding costs a few
+    microseconds per character, so prompts longer than max_chars are not cached at all
+    (truncating them would let different long prompts with a shared opening match).
+    """
+
+    def __init__(self, max_entries: int = 1024, threshold: float = 0.9, ttl_seconds: float = 86400.0, dim: int = 1024, max_chars: int = 2000):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.dim = dim
+        self.max_chars = max_chars
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        # Monotonic expiry per slot; 0 marks a free slot
+        self._expires_at = np.zeros(max_entries, dtype=np.float64)
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._answers = [None] * max_entries
+        self._clock = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.skipped = 0
+
+    def _nearest(self, vector: np.ndarray) -> Tuple[int, float]:
+        """Best live slot for `vector` and its similarity, or (-1, 0.0). Caller holds the lock."""
+        live = self._expires_at > time.monotonic()
+        if not live.any():
+            return -1, 0.0
+        scores = self._vectors @ vector
+        scores[~live] = -1.0
+        slot = int(scores.argmax())
+        return slot, float(scores[slot])
+
+    def _touch(self, slot: int):
+        self._clock += 1
+        self._last_used[slot] = self._clock
+
+    def lookup(self, prompt: str) -> Optional[str]:
+        """Return the answer cached for the most similar earlier prompt, or None."""
+        if len(prompt) > self.max_chars:
+            with self._lock:
+                self.skipped += 1
+            return None
+        vector = embed(prompt, self.dim)
+        with self._lock:
+            slot, score = self._nearest(vector)
+            if slot < 0 or score < self.threshold:
+                self.misses += 1
+                return None
+            self._touch(slot)
+            self.hits += 1
+            return self._answers[slot]
+
+    def store(self, prompt: str, answer: str):
+        """Cache the answer to `prompt`, replacing a near-identical entry if there is one."""
+        if len(prompt) > self.max_chars:
+            return
+        vector = embed(prompt, self.dim)
+        now = time.monotonic()
+        with self._lock:
+            slot, score = self._nearest(vector)
+            if slot < 0 or score < self.threshold:
+                free = np.flatnonzero(self._expires_at <= now)
+                if len(free):
+                    slot = int(free[0])
+                else:
+                    slot = int(self._last_used.argmin())
+                    self.evictions += 1
+            self._vectors[slot] = vector
+            self._expires_at[slot] = now + self.ttl_seconds
+            self._answers[slot] = answer
+            self._touch(slot)
+
+    def clear(self):
+        with self._lock:
+            self._expires_at[:] = 0.0
+            self._answers = [None] * self.max_entries
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": int((self._expires_at > time.monotonic()).sum()),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_seconds": self.ttl_seconds,
+                "dim": self.dim,
+                "max_chars": self.max_chars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "skipped": self.skipped,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,88 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+# Upper bounds in seconds of the latency histogram buckets (Prometheus "le" labels)
+BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Timings(dict):
+    """Seconds spent in each named stage of one request, in the order the stages ran."""
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self[name] = self.get(name, 0.0) + seconds
+
+    def server_timing(self) -> str:
+        """Format as a Server-Timing header value (durations in milliseconds)."""
+        return ", ".join(f"{name};dur={seconds * 1000.0:.2f}" for name, seconds in self.items())
+
+
+class StageHistograms:
+    """Thread-safe cumulative latency histograms, one per stage, in Prometheus text format."""
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # stage -> (per-bucket counts with a final +Inf bucket, sum of seconds)
+        self._stages: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, stage: str, seconds: float):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            counts, total = self._stages.setdefault(stage, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += seconds
+
+    def observe_all(self, timings: Dict[str, float]):
+        for stage, seconds in timings.items():
+            self.observe(stage, seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Count, total and mean seconds per stage, for the JSON stats endpoints."""
+        with self._lock:
+            summary = {}
+            for stage, (counts, total) in self._stages.items():
+                count = sum(counts)
+                summary[stage] = {
+                    "count": count,
+                    "sum_seconds": total[0],
+                    "mean_ms": total[0] / count * 1000.0 if count else 0.0,
+                }
+            return summary
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for stage, (counts, total) in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{self.name}_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{self.name}_sum{{stage="{stage}"}} {total[0]}')
+                lines.append(f'{self.name}_count{{stage="{stage}"}} {cumulative}')
+        return "\n".join(lines) + "\n"
+
+
+# Latency of every stage a detection goes through, from upload to the Gemini advice
+detection_stages = StageHistograms(
+    "detection_stage_seconds",
+    "Time spent in each stage of the detection pipeline."
+)
+
+
+def render_metrics() -> str:
+    """All histograms in the Prometheus text exposition format."""
+    return detection_stages.render()